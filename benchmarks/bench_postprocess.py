@@ -0,0 +1,76 @@
+"""Measure post-processing throughput against postprocess_workers.
+
+Each render decodes the same raw render response bytes with read_image and
+saves the background, thumbnail and a 4K output with save_outputs. Renders
+run concurrently, as when filling a pool. Run from the repository root:
+
+    python -m benchmarks.bench_postprocess
+
+Scaling needs spare cores: with a single core, worker processes only add
+the cost of copying images to shared memory.
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from pc_teams_background import TeamsBackgroundGenerator, concurrent_map, to_rgb
+from tests.helpers import make_noise_image, make_response, make_settings
+
+WORKERS = [0, 1, 2, 4]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--renders", type=int, default=8)
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    args = parser.parse_args()
+
+    buffer = io.BytesIO()
+    make_noise_image(args.width, args.height).save(buffer, format="PNG")
+    payload = buffer.getvalue()
+    Image.init()
+    print(
+        f"{args.renders} renders of {args.width}x{args.height} "
+        f"({len(payload) / 1024**2:.1f} MB PNG) on {os.cpu_count()} CPUs"
+    )
+    print(f"{'workers':>7} {'seconds':>7} {'renders/s':>9}")
+    with tempfile.TemporaryDirectory() as folder:
+        for workers in WORKERS:
+            settings = make_settings(
+                Path(folder),
+                postprocess_workers=workers,
+                outputs=[
+                    {
+                        "path": str(Path(folder) / "4k.jpg"),
+                        "width": 3840,
+                        "height": 2160,
+                    }
+                ],
+            )
+            generator = TeamsBackgroundGenerator(settings)
+            if workers:
+                # Start the pool up front, so only the renders are timed.
+                generator.get_process_pool().submit(int).result()
+
+            def render(i: int) -> None:
+                image = to_rgb(generator.read_image(make_response(payload)))
+                generator.save_outputs(
+                    image, settings.get_output_paths_in(Path(folder) / str(i))
+                )
+
+            start = time.perf_counter()
+            concurrent_map(render, range(args.renders), args.renders)
+            seconds = time.perf_counter() - start
+            print(f"{workers:>7} {seconds:>7.2f} {args.renders / seconds:>9.2f}")
+            if generator._process_pool:
+                generator._process_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
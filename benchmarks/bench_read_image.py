@@ -0,0 +1,109 @@
+"""Measure peak memory while downloading and decoding large rendered images.
+
+Compares TeamsBackgroundGenerator.read_image with feeding the download to
+PIL.ImageFile.Parser, which it replaced. Run from the repository root:
+
+    python -m benchmarks.bench_read_image
+
+Each measurement runs in a fresh process and streams the payload from a
+file, so the peak RSS growth covers only downloading and decoding. Peak RSS
+is read from /proc, so this runs on Linux only.
+"""
+import argparse
+import io
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+from PIL import Image, ImageFile
+
+from pc_teams_background import IMAGE_CHUNK_SIZE, TeamsBackgroundGenerator
+from tests.helpers import make_noise_image, make_settings
+
+SIZES = {"4K": (3840, 2160), "8K": (7680, 4320)}
+METHODS = ["parser", "read_image"]
+
+
+def max_rss_mb() -> float:
+    # Unlike ru_maxrss, VmHWM isn't inherited from the parent process.
+    for line in Path("/proc/self/status").read_text().splitlines():
+        if line.startswith("VmHWM:"):
+            return int(line.split()[1]) / 1024
+    raise RuntimeError("VmHWM not found")
+
+
+def read_with_parser(resp: requests.Response) -> Image.Image:
+    parser = ImageFile.Parser()
+    with resp:
+        for chunk in resp.iter_content(chunk_size=IMAGE_CHUNK_SIZE):
+            parser.feed(chunk)
+    return parser.close()
+
+
+def run(method: str, payload_path: Path) -> None:
+    Image.init()
+    with tempfile.TemporaryDirectory() as folder:
+        generator = TeamsBackgroundGenerator(make_settings(Path(folder)))
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.raw = payload_path.open("rb")
+        before = max_rss_mb()
+        start = time.perf_counter()
+        if method == "parser":
+            image = read_with_parser(resp)
+        else:
+            image = generator.read_image(resp)
+        elapsed = time.perf_counter() - start
+        print(f"{max_rss_mb() - before:.1f} {elapsed:.2f} {image.size}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--run", nargs=2, metavar=("METHOD", "PAYLOAD"))
+    parser.add_argument("--format", default="PNG", choices=["PNG", "JPEG"])
+    args = parser.parse_args()
+    if args.run:
+        run(args.run[0], Path(args.run[1]))
+        return
+
+    print(f"{'size':>4} {'payload MB':>10} {'frame MB':>8} ", end="")
+    print(f"{'method':>10} {'peak RSS growth MB':>18} {'seconds':>7}")
+    with tempfile.TemporaryDirectory() as folder:
+        for name, (width, height) in SIZES.items():
+            buffer = io.BytesIO()
+            image = make_noise_image(width, height)
+            if args.format == "PNG":
+                image.save(buffer, format="PNG", compress_level=1)
+            else:
+                image.save(buffer, format="JPEG", quality=95)
+            del image
+            payload_path = Path(folder) / f"{name}.{args.format.lower()}"
+            payload_path.write_bytes(buffer.getvalue())
+            payload_mb = buffer.tell() / 1024**2
+            del buffer
+            frame_mb = width * height * 3 / 1024**2
+            for method in METHODS:
+                output = subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "benchmarks.bench_read_image",
+                        "--run",
+                        method,
+                        str(payload_path),
+                    ],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout.split()
+                print(
+                    f"{name:>4} {payload_mb:>10.1f} {frame_mb:>8.1f} "
+                    f"{method:>10} {float(output[0]):>18.1f} {float(output[1]):>7.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
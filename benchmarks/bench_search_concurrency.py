@@ -0,0 +1,85 @@
+"""Measure AOI search wall time against max_search_concurrency.
+
+Searches run against the local stand-in STAC API from the tests, which
+waits a fixed latency before answering each search. Run from the
+repository root:
+
+    python -m benchmarks.bench_search_concurrency
+"""
+import argparse
+import io
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from shapely.geometry import box
+
+from pc_teams_background import TeamsBackgroundGenerator
+from tests.helpers import (
+    STAC_API_CONFORMANCE,
+    make_aoi_file,
+    make_item_dict,
+    make_settings,
+    start_fake_api,
+)
+
+CONCURRENCIES = [1, 2, 4, 8, 16]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--aois", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds")
+    args = parser.parse_args()
+
+    api = start_fake_api(
+        STAC_API_CONFORMANCE + ["https://api.stacspec.org/v1.0.0-rc.1/item-search#sort"]
+    )
+    api.latency = args.latency
+    now = datetime.utcnow()
+    api.items = [
+        make_item_dict(
+            f"item-{i}",
+            f"{now - timedelta(days=1):%Y-%m-%dT%H:%M:%SZ}",
+            [2 * i, 0, 2 * i + 1, 1],
+        )
+        for i in range(args.aois)
+    ]
+    print(f"{args.aois} AOIs, {args.latency * 1000:.0f} ms per search")
+    print(f"{'concurrency':>11} {'seconds':>7} {'speedup':>7}")
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            aoi_path = make_aoi_file(
+                Path(folder) / "aois.geojson",
+                [box(2 * i, 0, 2 * i + 1, 1) for i in range(args.aois)],
+            )
+            serial_seconds = None
+            for concurrency in CONCURRENCIES:
+                settings = make_settings(
+                    Path(folder),
+                    max_search_concurrency=concurrency,
+                    aois={"feature_collection_path": str(aoi_path)},
+                )
+                settings.apis.stac = api.url
+                generator = TeamsBackgroundGenerator(settings)
+                # Open the client up front, so only the searches are timed.
+                generator.get_client()
+                start = time.perf_counter()
+                with redirect_stdout(io.StringIO()):
+                    items = generator.get_target_items()
+                seconds = time.perf_counter() - start
+                assert len(items) == args.aois
+                serial_seconds = serial_seconds or seconds
+                print(
+                    f"{concurrency:>11} {seconds:>7.2f} "
+                    f"{serial_seconds / seconds:>6.1f}x"
+                )
+    finally:
+        api.shutdown()
+        api.server_close()
+
+
+if __name__ == "__main__":
+    main()
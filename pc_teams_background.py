@@ -1,27 +1,90 @@
 #!/usr/bin/python
 import argparse
-import io
+import hashlib
 import json
+import math
 import os
 import random
+import shutil
+import sqlite3
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from copy import deepcopy
 from datetime import datetime, timedelta, timezone
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 from uuid import uuid4
 
 import dateparser
+import numpy as np
 import pystac
 import requests
 import yaml
-from PIL import Image, ImageOps
+from PIL import Image
 from PIL.Image import Image as PILImage
 from pydantic import BaseModel, validator
 from pystac_client import Client
-from shapely.geometry import box, mapping, shape
+from requests.adapters import HTTPAdapter
+from shapely.geometry import Polygon, box, mapping, shape
+from shapely.geometry.base import BaseGeometry
+from shapely.prepared import PreparedGeometry, prep
+from shapely.strtree import STRtree
+from urllib3.util.retry import Retry
 
 AOI_LAST_ITEM_DT_KEY = "last_item_datetime"
+NEWEST_FIRST_SORTBY = "-properties.datetime"
+IMAGE_CHUNK_SIZE = 64 * 1024
+# Downloaded images larger than this are spooled to disk before decoding.
+IMAGE_SPOOL_SIZE = 1024 * 1024
+# Size of the strips images are copied to shared memory in.
+SHARED_IMAGE_STRIP_SIZE = 256 * 1024
+# Reduce images by an integer factor until within this factor of the
+# output size before resampling.
+RESIZE_REDUCING_GAP = 2.0
+# Maximum number of times to double the simplification tolerance when
+# fitting an AOI geometry into its vertex budget.
+MAX_SIMPLIFY_STEPS = 16
+# Width of the grid of pixels sampled to score image quality.
+QUALITY_SAMPLE_WIDTH = 128
+# Equatorial radius of the WGS 84 ellipsoid, as used by Web Mercator.
+EARTH_RADIUS_M = 6378137.0
+
+# Item fields needed to select a target item. Properties used by
+# collection filters are added to these.
+CANDIDATE_ITEM_FIELDS = [
+    "type",
+    "stac_version",
+    "id",
+    "collection",
+    "geometry",
+    "bbox",
+    "properties.datetime",
+    "properties.start_datetime",
+    "properties.end_datetime",
+]
+
+T = TypeVar("T")
+R = TypeVar("R")
+FloatOrArray = Union[float, np.ndarray]
 
 
 class SettingsError(Exception):
@@ -42,11 +105,26 @@ class CollectionConfig(BaseModel):
     rendering_option: Optional[str] = None
     search_days: int = 30
     filters: Optional[List[FilterConfig]] = None
+    search_cache_ttl_minutes: Optional[int] = None
 
 
 class AOIsConfig(BaseModel):
     feature_collection_path: str
     refresh_days: int = 1
+    batch_search: bool = False
+    batch_size: int = 50
+    state_path: Optional[str] = None
+    search_simplify_tolerance: Optional[float] = None
+    search_max_vertices: Optional[int] = None
+    search_simplify_fallback: Optional[Literal["convex_hull", "bbox"]] = None
+
+    def simplifies_search(self) -> bool:
+        return bool(self.search_simplify_tolerance or self.search_max_vertices)
+
+    def get_state_path(self) -> Path:
+        if self.state_path:
+            return Path(self.state_path)
+        return Path(f"{self.feature_collection_path}.state.sqlite")
 
     @validator("feature_collection_path")
     def _validate_fc_path(cls, v: str) -> str:
@@ -55,12 +133,102 @@ class AOIsConfig(BaseModel):
         return v
 
 
+class SearchCacheConfig(BaseModel):
+    folder: str
+    ttl_minutes: int = 60
+    max_entries: int = 200
+
+
+class RenderOptionsCacheConfig(BaseModel):
+    folder: str
+    ttl_hours: int = 24
+    max_entries: int = 100
+
+
+class HTTPConfig(BaseModel):
+    pool_size: int = 10
+    timeout: float = 60
+    retries: int = 3
+    backoff_factor: float = 0.5
+    download_timeout: float = 300
+    max_download_bytes: Optional[int] = None
+
+
+class ImageQuality(BaseModel):
+    nodata_fraction: float
+    bright_fraction: float
+    contrast: float
+    saturation: float
+
+
+class QualityConfig(BaseModel):
+    max_nodata_fraction: float = 0.25
+    max_bright_fraction: float = 0.5
+    min_contrast: float = 0.04
+    min_saturation: float = 0.05
+
+    def check(self, quality: ImageQuality) -> Optional[str]:
+        """Get the reason an image's quality is too low, if any."""
+        if quality.nodata_fraction > self.max_nodata_fraction:
+            return f"{quality.nodata_fraction:.0%} of the image has no data"
+        if quality.bright_fraction > self.max_bright_fraction:
+            return f"{quality.bright_fraction:.0%} of the image is bright or cloudy"
+        if quality.contrast < self.min_contrast:
+            return f"the image is washed out (contrast {quality.contrast:.3f})"
+        if quality.saturation < self.min_saturation:
+            return f"the image is washed out (saturation {quality.saturation:.3f})"
+        return None
+
+
+class DedupConfig(BaseModel):
+    index_path: str
+    max_distance: int = 10
+    history_size: int = 1000
+
+
+class PoolConfig(BaseModel):
+    folder: Optional[str] = None
+    batch_size: int = 5
+    low_water_mark: int = 1
+
+
 class APIURLConfig(BaseModel):
     stac: str
     info: str
     image: str
 
 
+class EncoderConfig(BaseModel):
+    quality: Optional[int] = None
+    optimize: bool = False
+    progressive: bool = False
+    subsampling: Optional[int] = None
+
+    def get_save_params(self) -> Dict[str, Any]:
+        """Get keyword arguments for PIL's Image.save.
+
+        Formats ignore parameters they don't support.
+        """
+        return self.dict(exclude_none=True)
+
+
+class OutputConfig(BaseModel):
+    path: str
+    width: int
+    height: int
+    format: Optional[str] = None
+    quality: Optional[int] = None
+    mirror: bool = False
+    encoder: Optional[EncoderConfig] = None
+
+
+class OutputPaths(BaseModel):
+    image: Path
+    thumbnail: Path
+    info: Path
+    outputs: List[Path] = []
+
+
 class Settings(BaseModel):
     image_name: str = "pc-teams-background.png"
     teams_image_folder: str
@@ -70,12 +238,32 @@ class Settings(BaseModel):
     thumbnail_width: int
     thumbnail_height: int
     apis: APIURLConfig
+    http: HTTPConfig = HTTPConfig()
     max_search_results: int = 1000
+    max_search_concurrency: int = 1
+    random_sample_size: Optional[int] = None
+    search_cache: Optional[SearchCacheConfig] = None
+    render_options_cache: Optional[RenderOptionsCacheConfig] = None
+    project_search_fields: bool = True
     aois: Optional[AOIsConfig] = None
     image_info_path: Optional[str] = None
     force_regen_after: Optional[str] = None
     mirror_image: bool = False
     show_branding: bool = True
+    prefetch: bool = False
+    staging_folder: Optional[str] = None
+    pipeline_render_params: bool = False
+    outputs: List[OutputConfig] = []
+    encoder: EncoderConfig = EncoderConfig()
+    render_tile_cols: int = 1
+    render_tile_rows: int = 1
+    max_render_attempts: int = 3
+    dedup: Optional[DedupConfig] = None
+    quality: Optional[QualityConfig] = None
+    pool: Optional[PoolConfig] = None
+    postprocess_workers: int = 0
+    framing: Literal["degrees", "web_mercator", "equidistant"] = "degrees"
+    max_frame_km: Optional[float] = None
 
     def get_image_path(self) -> Path:
         return Path(self.teams_image_folder) / self.image_name
@@ -92,6 +280,52 @@ class Settings(BaseModel):
             p = Path(self.teams_image_folder)
             return p.joinpath(f"{Path(self.image_name).stem}-info.json")
 
+    def get_output_paths(self) -> OutputPaths:
+        return OutputPaths(
+            image=self.get_image_path(),
+            thumbnail=self.get_thumbnail_path(),
+            info=self.get_image_info_path(),
+            outputs=[Path(output.path) for output in self.outputs],
+        )
+
+    def get_staging_folder(self) -> Path:
+        if self.staging_folder:
+            return Path(self.staging_folder)
+        return Path(self.teams_image_folder) / ".pc-teams-background-staging"
+
+    def get_staged_output_paths(self) -> OutputPaths:
+        """Paths of the next background, when prefetching."""
+        return self.get_output_paths_in(self.get_staging_folder())
+
+    def get_pool_folder(self) -> Path:
+        if self.pool and self.pool.folder:
+            return Path(self.pool.folder)
+        return Path(self.teams_image_folder) / ".pc-teams-background-pool"
+
+    def get_output_paths_in(self, folder: Path) -> OutputPaths:
+        """Paths for a background kept in a folder before it is put in place."""
+        output_paths = self.get_output_paths()
+        return OutputPaths(
+            image=folder / output_paths.image.name,
+            thumbnail=folder / output_paths.thumbnail.name,
+            info=folder / output_paths.info.name,
+            outputs=[
+                folder / f"output-{i}-{path.name}"
+                for i, path in enumerate(output_paths.outputs)
+            ],
+        )
+
+    def get_render_size(self) -> Tuple[int, int]:
+        """Get the image size to render, large enough for every output."""
+        scale = max(
+            [1.0]
+            + [
+                max(output.width / self.width, output.height / self.height)
+                for output in self.outputs
+            ]
+        )
+        return math.ceil(self.width * scale), math.ceil(self.height * scale)
+
     def get_force_regen_after_time(self, created_at: datetime) -> Optional[datetime]:
         if self.force_regen_after is None:
             return None
@@ -144,43 +378,699 @@ class ImageInfo(BaseModel):
         return cls(**settings)
 
 
+def cql_geom_op(geom: Dict[str, Any]) -> Dict[str, Any]:
+    return {"op": "s_intersects", "args": [{"property": "geometry"}, geom]}
+
+
+def cql_after_op(after: str) -> Dict[str, Any]:
+    return {
+        "op": "anyinteracts",
+        "args": [
+            {"property": "datetime"},
+            {"interval": [after, datetime.utcnow().isoformat()]},
+        ],
+    }
+
+
 def cql_add_geom_arg(cql: Dict[str, Any], geom: Dict[str, Any]):
     result = deepcopy(cql)
-    result["filter"]["args"].append(
-        {"op": "s_intersects", "args": [{"property": "geometry"}, geom]}
-    )
+    result["filter"]["args"].append(cql_geom_op(geom))
+    return result
+
+
+def cql_add_any_geom_arg(
+    cql: Dict[str, Any],
+    geoms: List[Dict[str, Any]],
+    afters: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Add an argument matching any of the geometries.
+
+    If afters is given, each geometry is only matched by items after
+    its corresponding datetime.
+    """
+    result = deepcopy(cql)
+    if afters is None:
+        geom_ops = [cql_geom_op(geom) for geom in geoms]
+    else:
+        geom_ops = [
+            {"op": "and", "args": [cql_geom_op(geom), cql_after_op(after)]}
+            for geom, after in zip(geoms, afters)
+        ]
+    result["filter"]["args"].append({"op": "or", "args": geom_ops})
     return result
 
 
 def cql_add_after_arg(cql: Dict[str, Any], after: str) -> Dict[str, Any]:
     result = deepcopy(cql)
-    result["filter"]["args"].append(
-        {
-            "op": "anyinteracts",
-            "args": [
-                {"property": "datetime"},
-                {"interval": [after, datetime.utcnow().isoformat()]},
-            ],
-        }
+    result["filter"]["args"].append(cql_after_op(after))
+    return result
+
+
+def canonical_cql(cql: Any) -> Any:
+    """Return a canonical form of a CQL body for use in cache keys.
+
+    Interval starts are truncated to the day, and interval ends (always the
+    current time for searches built here) are left open, so that repeating
+    a search later in the day produces the same key.
+    """
+    if isinstance(cql, dict):
+        if "interval" in cql:
+            return {"interval": [str(cql["interval"][0])[:10], ".."]}
+        return {k: canonical_cql(v) for k, v in cql.items()}
+    if isinstance(cql, list):
+        return [canonical_cql(v) for v in cql]
+    return cql
+
+
+def cache_key(**params: Any) -> str:
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def atomic_path(path: Path) -> Iterator[Path]:
+    """Yield a temporary path to write to, which then replaces path.
+
+    Readers of path never see a partially written file.
+    """
+    tmp_path = path.with_name(f".{path.name}.{uuid4().hex}.tmp")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+@contextmanager
+def time_stage(timings: Dict[str, float], stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = time.perf_counter() - start
+
+
+def write_text_atomic(path: Path, text: str) -> None:
+    with atomic_path(path) as tmp_path:
+        tmp_path.write_text(text)
+
+
+class JSONFileCache:
+    """A size capped on-disk cache of JSON values.
+
+    Each entry is stored in its own file in the cache folder. File
+    modification times record when an entry was last used, and the least
+    recently used entries are evicted once there are more than max_entries.
+    """
+
+    def __init__(self, folder: Path, max_entries: int):
+        self.folder = folder
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.folder / f"{key}.json"
+
+    def get_entry(self, key: str) -> Optional[Tuple[datetime, Any]]:
+        """Return the time an entry was stored and its value, regardless of age."""
+        path = self._entry_path(key)
+        try:
+            entry = json.loads(path.read_text())
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return datetime.fromisoformat(entry["created"]), entry["value"]
+
+    def get(self, key: str, ttl: timedelta) -> Optional[Any]:
+        entry = self.get_entry(key)
+        if entry and datetime.now(tz=timezone.utc) - entry[0] < ttl:
+            return entry[1]
+        return None
+
+    def put(self, key: str, value: Any) -> None:
+        self.folder.mkdir(parents=True, exist_ok=True)
+        write_text_atomic(
+            self._entry_path(key),
+            json.dumps(
+                {"created": datetime.now(tz=timezone.utc).isoformat(), "value": value}
+            ),
+        )
+        with self._lock:
+            entries = sorted(
+                self.folder.glob("*.json"), key=lambda p: p.stat().st_mtime
+            )
+            for stale_path in entries[: -self.max_entries or None]:
+                stale_path.unlink(missing_ok=True)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter that applies a default timeout to requests."""
+
+    def __init__(self, timeout: float, **kwargs: Any):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> Any:
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_session(config: HTTPConfig) -> requests.Session:
+    """Create a pooled HTTP session that retries failed requests."""
+    retry = Retry(
+        total=config.retries,
+        backoff_factor=config.backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=None,
+    )
+    adapter = TimeoutHTTPAdapter(
+        config.timeout,
+        pool_connections=config.pool_size,
+        pool_maxsize=config.pool_size,
+        max_retries=retry,
     )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_aoi_id(feature: Dict[str, Any]) -> str:
+    """Get the ID of an AOI feature.
+
+    Features without IDs are identified by a hash of their geometry.
+    """
+    if "id" in feature:
+        return str(feature["id"])
+    geometry = json.dumps(feature["geometry"], sort_keys=True)
+    return "geom-" + hashlib.sha1(geometry.encode("utf-8")).hexdigest()[:16]
+
+
+class AOIStateStore:
+    """The runtime state of AOIs, kept in a SQLite database keyed by AOI ID.
+
+    This keeps the AOI feature collection a read-only input.
+    """
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS aoi_state ("
+                "id TEXT PRIMARY KEY, "
+                "last_item_datetime TEXT, "
+                "hit_count INTEGER NOT NULL DEFAULT 0)"
+            )
+
+    def get_last_item_datetimes(self) -> Dict[str, str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, last_item_datetime FROM aoi_state "
+                "WHERE last_item_datetime IS NOT NULL"
+            ).fetchall()
+        return dict(rows)
+
+    def set_last_item_datetime(self, aoi_id: str, dt: datetime) -> None:
+        """Record a new item used for an AOI."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO aoi_state (id, last_item_datetime, hit_count) "
+                "VALUES (?, ?, 1) "
+                "ON CONFLICT(id) DO UPDATE SET "
+                "last_item_datetime = excluded.last_item_datetime, "
+                "hit_count = hit_count + 1",
+                (aoi_id, dt.isoformat()),
+            )
+
+
+def concurrent_map(
+    fn: Callable[[T], R], args: Iterable[T], max_workers: int
+) -> List[R]:
+    """Map fn over args using up to max_workers threads, preserving order."""
+    if max_workers <= 1:
+        return [fn(arg) for arg in args]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fn, args))
+
+
+def reservoir_sample(elements: Iterable[T], k: int) -> Tuple[List[T], int]:
+    """Uniformly sample up to k elements from an iterable of unknown length.
+
+    Only the sample is held in memory. Returns the sample and the number
+    of elements seen.
+    """
+    sample: List[T] = []
+    seen = 0
+    for element in elements:
+        seen += 1
+        if len(sample) < k:
+            sample.append(element)
+        else:
+            j = random.randrange(seen)
+            if j < k:
+                sample[j] = element
+    return sample, seen
+
+
+def lat_to_mercator_y(lat: FloatOrArray) -> FloatOrArray:
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def mercator_y_to_lat(y: FloatOrArray) -> FloatOrArray:
+    return np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+
+
+def frame_bounds(
+    bounds: np.ndarray,
+    aspect: float,
+    framing: str = "degrees",
+    max_extent_m: Optional[float] = None,
+) -> np.ndarray:
+    """Frame bounding boxes to an output aspect ratio (height / width).
+
+    Takes and returns an (N, 4) array of xmin, ymin, xmax, ymax in degrees.
+    The "degrees" framing fits the frame to the box's width in raw degrees.
+    The "web_mercator" and "equidistant" framings expand the box to contain
+    it in a projected metric around each box, and shrink frames whose longer
+    side exceeds max_extent_m meters on the ground around their center.
+    """
+    xmin, ymin, xmax, ymax = np.asarray(bounds, dtype=float).reshape(-1, 4).T
+    if framing == "degrees":
+        center_y = (ymin + ymax) / 2
+        half_height = (xmax - xmin) * aspect / 2
+        return np.stack([xmin, center_y - half_height, xmax, center_y + half_height], 1)
+
+    # Project to meters, along with the projected length of a ground meter
+    # at the center of each box.
+    center_lat = np.radians((ymin + ymax) / 2)
+    if framing == "web_mercator":
+        x_scale = np.full_like(center_lat, EARTH_RADIUS_M)
+        px0, px1 = np.radians(xmin) * x_scale, np.radians(xmax) * x_scale
+        py0 = lat_to_mercator_y(ymin) * EARTH_RADIUS_M
+        py1 = lat_to_mercator_y(ymax) * EARTH_RADIUS_M
+        meter = 1 / np.cos(center_lat)
+    elif framing == "equidistant":
+        x_scale = EARTH_RADIUS_M * np.cos(center_lat)
+        px0, px1 = np.radians(xmin) * x_scale, np.radians(xmax) * x_scale
+        py0, py1 = np.radians(ymin) * EARTH_RADIUS_M, np.radians(ymax) * EARTH_RADIUS_M
+        meter = np.ones_like(center_lat)
+    else:
+        raise Exception(f"Unknown framing: {framing}")
+
+    width = np.maximum(px1 - px0, (py1 - py0) / aspect)
+    if max_extent_m:
+        width = np.minimum(width, max_extent_m * meter / max(1.0, aspect))
+    half_width, half_height = width / 2, width * aspect / 2
+    center_x, center_y = (px0 + px1) / 2, (py0 + py1) / 2
+
+    x0 = np.degrees((center_x - half_width) / x_scale)
+    x1 = np.degrees((center_x + half_width) / x_scale)
+    if framing == "web_mercator":
+        y0 = mercator_y_to_lat((center_y - half_height) / EARTH_RADIUS_M)
+        y1 = mercator_y_to_lat((center_y + half_height) / EARTH_RADIUS_M)
+    else:
+        y0 = np.degrees((center_y - half_height) / EARTH_RADIUS_M)
+        y1 = np.degrees((center_y + half_height) / EARTH_RADIUS_M)
+    return np.stack([x0, np.clip(y0, -90, 90), x1, np.clip(y1, -90, 90)], 1)
+
+
+def split_evenly(total: int, parts: int) -> List[int]:
+    """Split a total into parts whose sizes differ by at most one."""
+    return [total * (i + 1) // parts - total * i // parts for i in range(parts)]
+
+
+def to_rgb(image: PILImage) -> PILImage:
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+def fit_image(image: PILImage, size: Tuple[int, int]) -> PILImage:
+    """Resize an image to a size, center cropping it to the size's aspect ratio.
+
+    The image is first shrunk by a cheap integer reduction, so the costly
+    resampling filter only runs on a small image.
+    """
+    if image.size == size:
+        return image
+    width, height = image.size
+    ratio = size[0] / size[1]
+    if width / height > ratio:
+        crop_width = height * ratio
+        crop_box = ((width - crop_width) / 2, 0, (width + crop_width) / 2, height)
+    else:
+        crop_height = width / ratio
+        crop_box = (0, (height - crop_height) / 2, width, (height + crop_height) / 2)
+    return image.resize(
+        size,
+        Image.Resampling.BICUBIC,
+        box=crop_box,
+        reducing_gap=RESIZE_REDUCING_GAP,
+    )
+
+
+def score_image(image: PILImage) -> ImageQuality:
+    """Score the quality of an image using a grid of sampled pixels.
+
+    Pixels that are transparent or black are counted as nodata; the other
+    scores are over the remaining pixels.
+    """
+    width = min(QUALITY_SAMPLE_WIDTH, image.width)
+    height = max(1, round(image.height * width / image.width))
+    # Point sampling only reads the sampled pixels, where filtering reads
+    # the whole image, which takes tens of milliseconds for 4K RGBA renders.
+    sample = image.resize((width, height), Image.Resampling.NEAREST)
+    if sample.mode not in ("RGB", "RGBA"):
+        sample = sample.convert("RGBA")
+    # Work on separate bands; NumPy reductions over a trailing axis of 3 or 4
+    # channels are slow.
+    bands = [
+        np.asarray(band, dtype=np.float32).ravel() / 255 for band in sample.split()
+    ]
+    red, green, blue = bands[:3]
+    channel_max = np.maximum(np.maximum(red, green), blue)
+    nodata = channel_max == 0
+    if len(bands) == 4:
+        nodata |= bands[3] == 0
+    nodata_fraction = float(nodata.mean())
+    valid = ~nodata
+    red, green, blue, channel_max = (b[valid] for b in (red, green, blue, channel_max))
+    if not len(red):
+        return ImageQuality(
+            nodata_fraction=nodata_fraction,
+            bright_fraction=0.0,
+            contrast=0.0,
+            saturation=0.0,
+        )
+
+    luminance = 0.299 * red + 0.587 * green + 0.114 * blue
+    histogram, _ = np.histogram(luminance, bins=10, range=(0.0, 1.0))
+    channel_min = np.minimum(np.minimum(red, green), blue)
+    return ImageQuality(
+        nodata_fraction=nodata_fraction,
+        bright_fraction=float(histogram[-1] / len(luminance)),
+        contrast=float(luminance.std()),
+        saturation=float(((channel_max - channel_min) / channel_max).mean()),
+    )
+
+
+def copy_to_shared_memory(rgb_image: PILImage) -> SharedMemory:
+    """Copy the pixels of an RGB image into a new shared memory block.
+
+    The image is copied in strips, so no full-frame bytes object is made.
+    """
+    width, height = rgb_image.size
+    row_size = width * 3
+    shared_memory = SharedMemory(create=True, size=row_size * height)
+    strip_rows = max(1, SHARED_IMAGE_STRIP_SIZE // row_size)
+    for top in range(0, height, strip_rows):
+        bottom = min(top + strip_rows, height)
+        strip = rgb_image.crop((0, top, width, bottom)).tobytes()
+        shared_memory.buf[top * row_size : bottom * row_size] = strip
+    return shared_memory
+
+
+def read_from_shared_memory(
+    shared_memory: SharedMemory, size: Tuple[int, int]
+) -> PILImage:
+    """Read an RGB image copied to shared memory by copy_to_shared_memory."""
+    width, height = size
+    row_size = width * 3
+    rgb_image = Image.new("RGB", size)
+    strip_rows = max(1, SHARED_IMAGE_STRIP_SIZE // row_size)
+    for top in range(0, height, strip_rows):
+        bottom = min(top + strip_rows, height)
+        strip = bytes(shared_memory.buf[top * row_size : bottom * row_size])
+        rgb_image.paste(Image.frombytes("RGB", (width, bottom - top), strip), (0, top))
+    return rgb_image
+
+
+class PostProcessJob(BaseModel):
+    """A picklable job that saves an RGB image in shared memory to an output.
+
+    Jobs can be run in a separate process, so that resizing and encoding
+    for many images and outputs use more than one core.
+    """
+
+    shared_memory_name: str
+    size: Tuple[int, int]
+    output: OutputConfig
+
+    def run(self) -> None:
+        shared_memory = SharedMemory(self.shared_memory_name)
+        try:
+            rgb_image = read_from_shared_memory(shared_memory, self.size)
+        finally:
+            shared_memory.close()
+        save_output(rgb_image, self.output)
+
+
+def run_post_process_job(job: PostProcessJob) -> None:
+    job.run()
+
+
+def dhash(image: PILImage) -> np.uint64:
+    """Compute the 64 bit difference hash of an image."""
+    pixels = np.asarray(
+        image.convert("L").resize(
+            (9, 8), Image.Resampling.BILINEAR, reducing_gap=RESIZE_REDUCING_GAP
+        ),
+        dtype=np.int16,
+    )
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return np.packbits(bits).view(">u8").astype(np.uint64)[0]
+
+
+class ImageHashIndex:
+    """The perceptual hashes of recent backgrounds, stored as a NumPy array."""
+
+    def __init__(self, path: Path, history_size: int):
+        self.path = path
+        self.history_size = history_size
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        if path.exists():
+            self.hashes = np.load(path)
+        self._lock = threading.Lock()
+
+    def min_distance(self, image_hash: np.uint64) -> Optional[int]:
+        """Get the smallest Hamming distance from a hash to the stored hashes."""
+        hashes = self.hashes
+        if not len(hashes):
+            return None
+        differences = np.bitwise_xor(hashes, image_hash).view(np.uint8)
+        return int(np.unpackbits(differences).reshape(-1, 64).sum(axis=1).min())
+
+    def add(self, image_hash: np.uint64) -> None:
+        with self._lock:
+            self.hashes = np.append(self.hashes, image_hash)[-self.history_size :]
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with atomic_path(self.path) as tmp_path:
+                with open(tmp_path, "wb") as f:
+                    np.save(f, self.hashes)
+
+
+def save_output(rgb_image: PILImage, output: OutputConfig) -> None:
+    image = fit_image(rgb_image, (output.width, output.height))
+    if output.mirror:
+        image = image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    params = (output.encoder or EncoderConfig()).get_save_params()
+    if output.quality is not None:
+        params["quality"] = output.quality
+    path = Path(output.path)
+    image_format = output.format
+    if not image_format:
+        # registered_extensions only loads the image plugins if none are
+        # loaded, so load them first in case another thread is loading them.
+        Image.init()
+        image_format = Image.registered_extensions()[path.suffix.lower()]
+    with atomic_path(path) as tmp_path:
+        image.save(tmp_path, format=image_format, **params)
+
+
+class AOIIndex:
+    """A spatial index over the features of an AOI feature collection.
+
+    Answers which AOIs intersect a geometry or bounding box, using an
+    STRtree of the AOI geometries and prepared geometries for the exact
+    intersection tests.
+    """
+
+    def __init__(
+        self,
+        features: List[Dict[str, Any]],
+        geometries: Optional[List[BaseGeometry]] = None,
+    ):
+        self.features = features
+        self.geometries = geometries or [
+            shape(feature["geometry"]) for feature in features
+        ]
+        self.prepared: List[PreparedGeometry] = [prep(geom) for geom in self.geometries]
+        self._tree = STRtree(self.geometries)
+        self._indexes = {id(geom): i for i, geom in enumerate(self.geometries)}
+
+    def query(self, geom: BaseGeometry) -> List[int]:
+        """Get the indexes of the features that intersect a geometry."""
+        indexes = (self._indexes[id(candidate)] for candidate in self._tree.query(geom))
+        return sorted(i for i in indexes if self.prepared[i].intersects(geom))
+
+    def query_item(self, item: pystac.Item) -> List[int]:
+        if not item.geometry:
+            return []
+        return self.query(shape(item.geometry))
+
+    def query_bbox(self, bbox: Sequence[float]) -> List[int]:
+        return self.query(box(*bbox))
+
+
+def count_vertices(geom: BaseGeometry) -> int:
+    if hasattr(geom, "geoms"):
+        return sum(count_vertices(part) for part in geom.geoms)
+    if isinstance(geom, Polygon):
+        return len(geom.exterior.coords) + sum(
+            len(interior.coords) for interior in geom.interiors
+        )
+    return len(geom.coords)
+
+
+def simplify_geometry(
+    geom: BaseGeometry,
+    tolerance: Optional[float] = None,
+    max_vertices: Optional[int] = None,
+    fallback: Optional[str] = None,
+) -> BaseGeometry:
+    """Simplify a geometry, preserving topology.
+
+    If max_vertices is given, the tolerance is doubled until the geometry
+    fits within that many vertices. If it still doesn't fit, the geometry is
+    replaced with its convex hull or bounding box if a fallback is given.
+    """
+    result = geom.simplify(tolerance, preserve_topology=True) if tolerance else geom
+    if not max_vertices or count_vertices(result) <= max_vertices:
+        return result
+
+    xmin, ymin, xmax, ymax = geom.bounds
+    step = tolerance or max(xmax - xmin, ymax - ymin) / 1000
+    for _ in range(MAX_SIMPLIFY_STEPS):
+        step *= 2
+        result = geom.simplify(step, preserve_topology=True)
+        if count_vertices(result) <= max_vertices:
+            return result
+    if fallback == "convex_hull":
+        return geom.convex_hull
+    if fallback == "bbox":
+        return geom.envelope
     return result
 
 
-def ensure_ids(fc_path: Path) -> None:
-    """Ensure a feature collection has IDs set.
+class AOIRegistry:
+    """The parsed features of an AOI feature collection file.
 
-    If not, set them and write out the file.
+    Registries are kept for the life of the process, so repeated runs
+    reuse them, and are reloaded when the file's modification time or
+    size changes.
     """
-    with open(fc_path) as f:
-        feature_collection = json.load(f)
-    write = False
-    for feature in feature_collection["features"]:
-        if "id" not in feature:
-            write = True
-            feature["id"] = str(uuid4())
-    if write:
-        with open(fc_path, "w") as f:
-            json.dump(feature_collection, f, indent=2)
+
+    _registries: Dict[Path, "AOIRegistry"] = {}
+    _registries_lock = threading.Lock()
+
+    def __init__(self, path: Path, stat: os.stat_result):
+        self.path = path
+        self.stat_key = (stat.st_mtime_ns, stat.st_size)
+        self.features: List[Dict[str, Any]] = json.loads(path.read_text())["features"]
+        for feature in self.features:
+            feature["id"] = get_aoi_id(feature)
+            feature["properties"] = feature.get("properties") or {}
+        self.geometries = [shape(feature["geometry"]) for feature in self.features]
+        self.bounds = [geom.bounds for geom in self.geometries]
+        self.feature_indexes = {
+            feature["id"]: i for i, feature in enumerate(self.features)
+        }
+        self._index: Optional[AOIIndex] = None
+        self._search_geometries: Dict[Tuple[Any, ...], List[Dict[str, Any]]] = {}
+        self.frames: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "AOIRegistry":
+        path = Path(path).resolve()
+        stat = path.stat()
+        with cls._registries_lock:
+            registry = cls._registries.get(path)
+            if not registry or registry.stat_key != (stat.st_mtime_ns, stat.st_size):
+                registry = cls(path, stat)
+                cls._registries[path] = registry
+            return registry
+
+    def get_index(self) -> AOIIndex:
+        with self._lock:
+            if not self._index:
+                self._index = AOIIndex(self.features, self.geometries)
+            return self._index
+
+    def get_search_geometries(
+        self,
+        tolerance: Optional[float] = None,
+        max_vertices: Optional[int] = None,
+        fallback: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Get the geometries to search with, simplified as requested.
+
+        Simplified geometries are computed once per set of options.
+        """
+        key = (tolerance, max_vertices, fallback)
+        with self._lock:
+            if key not in self._search_geometries:
+                if tolerance or max_vertices:
+                    search_geometries = [
+                        mapping(
+                            simplify_geometry(geom, tolerance, max_vertices, fallback)
+                        )
+                        for geom in self.geometries
+                    ]
+                    original_size = len(
+                        json.dumps([feature["geometry"] for feature in self.features])
+                    )
+                    simplified_size = len(json.dumps(search_geometries))
+                    print(
+                        f"Simplified AOI geometries from {original_size} "
+                        f"to {simplified_size} bytes"
+                    )
+                else:
+                    search_geometries = [
+                        feature["geometry"] for feature in self.features
+                    ]
+                self._search_geometries[key] = search_geometries
+            return self._search_geometries[key]
+
+
+def get_aoi_last_item_datetime(feature: Dict[str, Any]) -> Optional[datetime]:
+    last_dt = feature["properties"].get(AOI_LAST_ITEM_DT_KEY)
+    return datetime.fromisoformat(last_dt) if last_dt else None
+
+
+def get_aoi_search_after(feature: Dict[str, Any], search_after: str) -> str:
+    """Get the start of the search window for an AOI.
+
+    Only items newer than the last item used for the AOI are searched for.
+    """
+    last_dt = get_aoi_last_item_datetime(feature)
+    if not last_dt:
+        return search_after
+    if last_dt.tzinfo:
+        last_dt = last_dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return max(datetime.fromisoformat(search_after), last_dt).isoformat()
+
+
+def item_from_dict(d: Dict[str, Any]) -> pystac.Item:
+    # Items projected with the fields extension may be missing the type,
+    # version, links and assets, which pystac requires.
+    defaults = {
+        "type": "Feature",
+        "stac_version": pystac.get_stac_version(),
+        "links": [],
+        "assets": {},
+    }
+    return pystac.Item.from_dict({**defaults, **d})
 
 
 def get_datetime(item: pystac.Item) -> datetime:
@@ -191,9 +1081,163 @@ def get_datetime(item: pystac.Item) -> datetime:
 
 
 class TeamsBackgroundGenerator:
-    def __init__(self, settings: Settings, force: bool = False):
+    def __init__(
+        self,
+        settings: Settings,
+        force: bool = False,
+        use_cache: bool = True,
+        session: Optional[requests.Session] = None,
+    ):
         self.settings = settings
         self.force = force
+        self.session = session or create_session(settings.http)
+        self.search_cache: Optional[JSONFileCache] = None
+        if use_cache and settings.search_cache:
+            self.search_cache = JSONFileCache(
+                Path(settings.search_cache.folder), settings.search_cache.max_entries
+            )
+        self.render_options_cache: Optional[JSONFileCache] = None
+        if use_cache and settings.render_options_cache:
+            self.render_options_cache = JSONFileCache(
+                Path(settings.render_options_cache.folder),
+                settings.render_options_cache.max_entries,
+            )
+        self._client: Optional[Client] = None
+        self._client_lock = threading.Lock()
+        self.aoi_state: Optional[AOIStateStore] = None
+        if settings.aois:
+            self.aoi_state = AOIStateStore(settings.aois.get_state_path())
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._process_pool_lock = threading.Lock()
+        self.hash_index: Optional[ImageHashIndex] = None
+        if settings.dedup:
+            self.hash_index = ImageHashIndex(
+                Path(settings.dedup.index_path), settings.dedup.history_size
+            )
+
+    def get_client(self) -> Client:
+        # Opened lazily, so runs answered entirely from the search cache
+        # make no requests to the STAC API.
+        with self._client_lock:
+            if self._client is None:
+                # Client.open ignores conformance for APIs with a search
+                # link but no conformsTo, which from_file does not.
+                self._client = Client.open(self.settings.apis.stac)
+                self._client._stac_io.session = self.session  # type: ignore
+            return self._client
+
+    def conforms_to(self, conformance_class: str) -> bool:
+        conforms_to = self.get_client().extra_fields.get("conformsTo", [])
+        return any(uri.endswith(conformance_class) for uri in conforms_to)
+
+    def supports_fields(self) -> bool:
+        return self.conforms_to("#fields")
+
+    def supports_sort(self) -> bool:
+        return self.conforms_to("#sort")
+
+    def get_candidate_fields(self, collection_id: str) -> Dict[str, List[str]]:
+        collection_config = self.settings.get_collection_config(collection_id)
+        filter_fields = [
+            f"properties.{f.property}" for f in (collection_config.filters or [])
+        ]
+        return {
+            "include": CANDIDATE_ITEM_FIELDS + filter_fields,
+            "exclude": ["assets", "links"],
+        }
+
+    def get_full_item(self, item: pystac.Item) -> pystac.Item:
+        """Fetch the full item for a search result that may have been projected."""
+        collection_id = item.collection_id
+        assert collection_id
+        cql = self.get_base_cql(collection_id, None)
+        cql["filter"]["args"].append({"op": "=", "args": [{"property": "id"}, item.id]})
+        items, _, _ = self.search_item_dicts(collection_id, cql, max_items=1)
+        if not items:
+            raise Exception(f"Item {item.id} not found in {collection_id}")
+        full_item = item_from_dict(items[0])
+        for key in ["aoi", "aoi_geom"]:
+            if key in item.properties:
+                full_item.properties[key] = item.properties[key]
+        return full_item
+
+    def search_item_dicts(
+        self,
+        collection_id: str,
+        cql: Dict[str, Any],
+        max_items: int,
+        sample_size: Optional[int] = None,
+        newest_first: bool = False,
+        limit: Optional[int] = None,
+        project: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], int, bool]:
+        """Search for items, using the search cache if configured.
+
+        If sample_size is given, results are streamed and only a uniform
+        random sample of them is kept. If newest_first is True, the newest
+        items are returned; APIs without the sort extension are searched up
+        to max_search_results items, which are sorted locally. If project is
+        True, only the fields needed to select a target item are requested,
+        where the API supports it. Returns the item dicts, the number of
+        items found, and whether the API sorted them newest first.
+        """
+        sortby = NEWEST_FIRST_SORTBY if newest_first else None
+        fields: Optional[Dict[str, List[str]]] = None
+        if project and self.settings.project_search_fields:
+            fields = self.get_candidate_fields(collection_id)
+        key = cache_key(
+            stac=self.settings.apis.stac,
+            cql=canonical_cql(cql),
+            max_items=max_items,
+            sample_size=sample_size,
+            sortby=sortby,
+            fields=fields,
+        )
+        if self.search_cache and self.settings.search_cache:
+            ttl_minutes = (
+                self.settings.get_collection_config(
+                    collection_id
+                ).search_cache_ttl_minutes
+                or self.settings.search_cache.ttl_minutes
+            )
+            cached = self.search_cache.get(key, timedelta(minutes=ttl_minutes))
+            if cached is not None:
+                return cached["items"], cached["found"], cached.get("sorted", False)
+
+        if fields and not self.supports_fields():
+            fields = None
+        search_max_items = max_items
+        if sortby and not self.supports_sort():
+            sortby = None
+            search_max_items = max(max_items, self.settings.max_search_results)
+            limit = None
+        search = self.get_client().search(
+            filter=cql,
+            max_items=search_max_items,
+            sortby=sortby,
+            limit=limit,
+            fields=fields,
+        )
+        if sample_size:
+            items, found = reservoir_sample(search.items_as_dicts(), sample_size)
+        else:
+            items = list(search.items_as_dicts())
+            found = len(items)
+            if newest_first and not sortby:
+                # Sort on the RFC 3339 strings, without parsing every item.
+                items.sort(
+                    key=lambda d: d["properties"].get("datetime")
+                    or d["properties"].get("start_datetime")
+                    or "",
+                    reverse=True,
+                )
+                items = items[:max_items]
+
+        if self.search_cache:
+            self.search_cache.put(
+                key, {"items": items, "found": found, "sorted": bool(sortby)}
+            )
+        return items, found, bool(sortby)
 
     def should_generate_new_background(self) -> bool:
         image_path = self.settings.get_image_path()
@@ -250,26 +1294,113 @@ class TeamsBackgroundGenerator:
             },
         }
 
+    def get_bg_geoms(self, base_geoms: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Frame many geometries to the output aspect ratio at once."""
+        return self.get_bg_geoms_for_bounds([shape(geom).bounds for geom in base_geoms])
+
+    def get_bg_geoms_for_bounds(
+        self, bounds: Sequence[Sequence[float]]
+    ) -> List[Dict[str, Any]]:
+        """Frame many bounding boxes to the output aspect ratio at once."""
+        if not bounds:
+            return []
+        frames = frame_bounds(
+            np.array(bounds),
+            self.settings.height / self.settings.width,
+            self.settings.framing,
+            self.settings.max_frame_km * 1000 if self.settings.max_frame_km else None,
+        )
+        return [mapping(box(*frame)) for frame in frames.tolist()]
+
     def get_bg_geom(self, base_geom: Dict[str, Any]) -> Dict[str, Any]:
-        geom = shape(base_geom)
-        envelope = geom.envelope
-        bounds: List[float] = list(envelope.bounds)
-        width: float = bounds[2] - bounds[0]
-        height: float = bounds[3] - bounds[1]
-        new_height: float = width * (self.settings.height / self.settings.width)
-        height_diff: float = new_height - height
-        xmin: float = bounds[0]
-        xmax: float = bounds[2]
-        ymin: float = bounds[1] - (height_diff / 2)
-        ymax: float = bounds[3] + (height_diff / 2)
-
-        return mapping(box(xmin, ymin, xmax, ymax))
+        return self.get_bg_geoms([base_geom])[0]
+
+    def get_aoi_bg_geom(self, aoi_id: str, aoi_geom: Dict[str, Any]) -> Dict[str, Any]:
+        """Get the background geometry of an AOI, cached per AOI and output size."""
+        assert self.settings.aois
+        registry = AOIRegistry.load(self.settings.aois.feature_collection_path)
+        key = (
+            aoi_id,
+            self.settings.width,
+            self.settings.height,
+            self.settings.framing,
+            self.settings.max_frame_km,
+        )
+        frame = registry.frames.get(key)
+        if frame is None:
+            # Use the registry's precomputed bounds, unless the AOI has since
+            # been removed from the feature collection.
+            i = registry.feature_indexes.get(aoi_id)
+            if i is None:
+                frame = self.get_bg_geom(aoi_geom)
+            else:
+                frame = self.get_bg_geoms_for_bounds([registry.bounds[i]])[0]
+            registry.frames[key] = frame
+        return frame
+
+    def get_mosaic_info(self, collection_id: str) -> Dict[str, Any]:
+        """Get the mosaic info for a collection, using the render options cache.
+
+        Expired cache entries are revalidated with a conditional request.
+        """
+        params = {"collection": collection_id}
+        if not (self.render_options_cache and self.settings.render_options_cache):
+            resp = self.session.get(self.settings.apis.info, params=params)
+            resp.raise_for_status()
+            return resp.json()
+
+        key = cache_key(info=self.settings.apis.info, collection=collection_id)
+        ttl = timedelta(hours=self.settings.render_options_cache.ttl_hours)
+        entry = self.render_options_cache.get_entry(key)
+        headers: Dict[str, str] = {}
+        if entry:
+            created, cached = entry
+            if datetime.now(tz=timezone.utc) - created < ttl:
+                return cached["mosaic_info"]
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        resp = self.session.get(self.settings.apis.info, params=params, headers=headers)
+        if entry and resp.status_code == 304:
+            cached = entry[1]
+        else:
+            resp.raise_for_status()
+            cached = {
+                "mosaic_info": resp.json(),
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+            }
+        self.render_options_cache.put(key, cached)
+        return cached["mosaic_info"]
+
+    def warm_render_options(self) -> None:
+        """Fetch the mosaic info of all configured collections concurrently."""
+        concurrent_map(
+            self.get_mosaic_info,
+            [collection_config.id for collection_config in self.settings.collections],
+            len(self.settings.collections),
+        )
+
+    def prefetch_render_params(self) -> Dict[str, "Future[str]"]:
+        """Start fetching the render params of all configured collections."""
+        executor = ThreadPoolExecutor(max_workers=len(self.settings.collections))
+        futures = {
+            collection_config.id: executor.submit(
+                self.get_render_params,
+                collection_config.id,
+                collection_config.rendering_option,
+            )
+            for collection_config in self.settings.collections
+        }
+        executor.shutdown(wait=False)
+        return futures
 
     def get_render_params(
         self, collection_id: str, render_options_name: Optional[str] = None
     ) -> str:
-        resp = requests.get(f"{self.settings.apis.info}?collection={collection_id}")
-        mosaic_info = resp.json()
+        mosaic_info = self.get_mosaic_info(collection_id)
         if render_options_name:
             for render_options in mosaic_info["render_options"]:
                 if render_options["name"] == render_options_name:
@@ -277,86 +1408,498 @@ class TeamsBackgroundGenerator:
         return mosaic_info["renderOptions"][0]["options"]
 
     def fetch_image(self, request_data: Dict[str, Any]) -> PILImage:
-        resp = requests.post(self.settings.apis.image, json=request_data)
+        resp = self.session.post(self.settings.apis.image, json=request_data)
         resp.raise_for_status()
         resp_json = resp.json()
-        bytes = requests.get(resp_json["url"]).content
-        return Image.open(io.BytesIO(bytes))
+        image_resp = self.session.get(resp_json["url"], stream=True)
+        image_resp.raise_for_status()
+        return self.read_image(image_resp)
+
+    def render_image(self, request_data: Dict[str, Any]) -> PILImage:
+        if self.settings.render_tile_cols * self.settings.render_tile_rows > 1:
+            return self.fetch_tiled_image(request_data)
+        return self.fetch_image(request_data)
+
+    def fetch_tiled_image(self, request_data: Dict[str, Any]) -> PILImage:
+        """Render an image as a grid of tiles requested concurrently.
+
+        The tiles are stitched together locally.
+        """
+        cols: int = request_data["cols"]
+        rows: int = request_data["rows"]
+        tile_cols = split_evenly(cols, self.settings.render_tile_cols)
+        tile_rows = split_evenly(rows, self.settings.render_tile_rows)
+        xmin, ymin, xmax, ymax = shape(request_data["geometry"]).bounds
+        # Images are rendered in Web Mercator, so split rows evenly in
+        # Mercator space for tile edges to fall on pixel boundaries.
+        top = lat_to_mercator_y(ymax)
+        bottom = lat_to_mercator_y(ymin)
+
+        tiles: List[Tuple[Tuple[int, int], Dict[str, Any]]] = []
+        y = 0
+        for tile_height in tile_rows:
+            tile_ymax = mercator_y_to_lat(top - (top - bottom) * y / rows)
+            tile_ymin = mercator_y_to_lat(
+                top - (top - bottom) * (y + tile_height) / rows
+            )
+            x = 0
+            for tile_width in tile_cols:
+                tile_xmin = xmin + (xmax - xmin) * x / cols
+                tile_xmax = xmin + (xmax - xmin) * (x + tile_width) / cols
+                tile_request = {
+                    **request_data,
+                    "geometry": mapping(
+                        box(tile_xmin, tile_ymin, tile_xmax, tile_ymax)
+                    ),
+                    "cols": tile_width,
+                    "rows": tile_height,
+                    "showBranding": False,
+                }
+                tiles.append(((x, y), tile_request))
+                x += tile_width
+            y += tile_height
+        # Branding is drawn in the bottom corner of an image, so it is only
+        # requested for the bottom right tile.
+        tiles[-1][1]["showBranding"] = request_data["showBranding"]
+
+        print(f"Rendering image as {len(tiles)} tiles...")
+        tile_images = concurrent_map(
+            lambda tile: self.fetch_image(tile[1]), tiles, len(tiles)
+        )
+        image = Image.new("RGB", (cols, rows))
+        for (offset, _), tile_image in zip(tiles, tile_images):
+            image.paste(to_rgb(tile_image), offset)
+        return image
+
+    def read_image(self, resp: requests.Response) -> PILImage:
+        """Download an image to a spooled temporary file and decode it.
+
+        Small images are kept in memory; larger ones are written to disk, so
+        the encoded payload isn't held in memory alongside the decoded frame.
+        """
+        max_bytes = self.settings.http.max_download_bytes
+        content_length = int(resp.headers.get("Content-Length") or 0)
+        if max_bytes and content_length > max_bytes:
+            raise Exception(f"Image is too large ({content_length} bytes)")
+
+        deadline = time.monotonic() + self.settings.http.download_timeout
+        with tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_SIZE) as tmp:
+            downloaded = 0
+            with resp:
+                for chunk in resp.iter_content(chunk_size=IMAGE_CHUNK_SIZE):
+                    downloaded += len(chunk)
+                    if max_bytes and downloaded > max_bytes:
+                        raise Exception(f"Image is larger than {max_bytes} bytes")
+                    if time.monotonic() > deadline:
+                        raise Exception("Timed out downloading image")
+                    tmp.write(chunk)
+            tmp.seek(0)
+            image = Image.open(tmp)
+            image.load()
+            return image
+
+    def search_aoi_item(
+        self,
+        collection_id: str,
+        base_cql: Dict[str, Any],
+        search_after: str,
+        feature: Dict[str, Any],
+        search_geometry: Dict[str, Any],
+        aoi_geometry: Optional[PreparedGeometry] = None,
+    ) -> Optional[pystac.Item]:
+        """Search for the newest item over an AOI.
+
+        If aoi_geometry is given, the search geometry only approximates the
+        AOI, so up to max_search_results items are searched and the newest
+        one that intersects aoi_geometry is used.
+        """
+        aoi_cql = cql_add_geom_arg(base_cql, search_geometry)
+        aoi_cql = cql_add_after_arg(
+            aoi_cql, get_aoi_search_after(feature, search_after)
+        )
+        max_items: int = 1
+        limit: Optional[int] = 1
+        if aoi_geometry is not None:
+            max_items, limit = self.settings.max_search_results, None
+        items, _, _ = self.search_item_dicts(
+            collection_id,
+            aoi_cql,
+            max_items=max_items,
+            newest_first=True,
+            limit=limit,
+            project=True,
+        )
+        for item in map(item_from_dict, items):
+            if aoi_geometry is None or (
+                item.geometry and aoi_geometry.intersects(shape(item.geometry))
+            ):
+                return self.accept_aoi_item(feature, item)
+        return None
+
+    def search_aoi_items_batched(
+        self,
+        collection_id: str,
+        base_cql: Dict[str, Any],
+        search_after: str,
+        features: List[Dict[str, Any]],
+        search_geometries: List[Dict[str, Any]],
+        aoi_index: AOIIndex,
+        batch: range,
+    ) -> List[pystac.Item]:
+        """Search for new items over a batch of AOIs with a single query.
+
+        Returned items are assigned back to the AOIs they intersect locally,
+        keeping the newest item for each AOI. If the query hits the result
+        limit, AOIs whose newest item may be past it are searched one by one.
+        """
+        aoi_cql = cql_add_any_geom_arg(
+            base_cql,
+            [search_geometries[i] for i in batch],
+            [get_aoi_search_after(features[i], search_after) for i in batch],
+        )
+
+        item_dicts, found, api_sorted = self.search_item_dicts(
+            collection_id,
+            aoi_cql,
+            self.settings.max_search_results,
+            newest_first=True,
+            project=True,
+        )
+        newest: Dict[int, pystac.Item] = {}
+        for item in map(item_from_dict, item_dicts):
+            item_dt = get_datetime(item)
+            for i in aoi_index.query_item(item):
+                if i not in batch:
+                    continue
+                if i not in newest or item_dt > get_datetime(newest[i]):
+                    newest[i] = item
+        # Results are newest first, so an AOI matched within the limit has
+        # its newest item. Without the sort extension, none of them may.
+        requery: Set[int] = set()
+        simplified = bool(self.settings.aois and self.settings.aois.simplifies_search())
+        if found >= self.settings.max_search_results:
+            if api_sorted:
+                requery = {i for i in batch if i not in newest}
+            else:
+                requery = set(batch)
+            print(f"(limit hit, searching {len(requery)} AOIs one by one)")
+
+        result: List[pystac.Item] = []
+        for i in batch:
+            aoi_item: Optional[pystac.Item] = None
+            if i in requery:
+                aoi_item = self.search_aoi_item(
+                    collection_id,
+                    base_cql,
+                    search_after,
+                    features[i],
+                    search_geometries[i],
+                    aoi_index.prepared[i] if simplified else None,
+                )
+            elif i in newest:
+                aoi_item = self.accept_aoi_item(features[i], newest[i].clone())
+            if aoi_item:
+                result.append(aoi_item)
+        return result
+
+    def accept_aoi_item(
+        self, feature: Dict[str, Any], aoi_item: pystac.Item
+    ) -> Optional[pystac.Item]:
+        """Tag the newest item over an AOI, if it has not already been used."""
+        aoi_id = feature["id"]
+        this_dt = get_datetime(aoi_item)
+        last_dt = get_aoi_last_item_datetime(feature)
+        if not last_dt or this_dt > last_dt:
+            print(f"Found new item that intersects AOI {aoi_id}...")
+            aoi_item.properties["aoi"] = aoi_id
+            aoi_item.properties["aoi_geom"] = feature["geometry"]
+            return aoi_item
+        return None
 
     def get_target_items(self) -> List[pystac.Item]:
-        client = Client.open(self.settings.apis.stac)
         target_aoi_items: List[pystac.Item] = []
         target_random_items: List[pystac.Item] = []
 
+        search_afters: Dict[str, str] = {}
+        base_cqls: Dict[str, Dict[str, Any]] = {}
         for collection_config in self.settings.collections:
-            collection_id = collection_config.id
-            search_after = (
+            search_afters[collection_config.id] = (
                 datetime.utcnow() - timedelta(days=collection_config.search_days)
             ).isoformat()
+            base_cqls[collection_config.id] = self.get_base_cql(
+                collection_config.id, collection_config.filters
+            )
 
-            base_cql = self.get_base_cql(collection_id, collection_config.filters)
-
-            if self.settings.aois:
-                fc_path = Path(self.settings.aois.feature_collection_path)
-
-                print("Finding items that intersect AOIs...")
-                features = json.loads(fc_path.read_text())["features"]
-                for feature in features:
-                    aoi_id = feature["id"]
-                    aoi_cql = cql_add_geom_arg(base_cql, feature["geometry"])
-                    aoi_cql = cql_add_after_arg(aoi_cql, search_after)
-                    aoi_item = next(
-                        client.search(
-                            filter=aoi_cql,
-                            max_items=self.settings.max_search_results,
-                        ).items(),
-                        None,
+        # Run the AOI x collection searches up front, possibly concurrently,
+        # keeping results in the same order as a serial search.
+        aoi_items: Dict[str, List[pystac.Item]] = {}
+        if self.settings.aois:
+            print("Finding items that intersect AOIs...")
+            aoi_registry = AOIRegistry.load(self.settings.aois.feature_collection_path)
+            features = self.load_aoi_features(aoi_registry)
+            search_geometries = aoi_registry.get_search_geometries(
+                self.settings.aois.search_simplify_tolerance,
+                self.settings.aois.search_max_vertices,
+                self.settings.aois.search_simplify_fallback,
+            )
+            if self.settings.aois.batch_search:
+                aoi_index = aoi_registry.get_index()
+                batch_size = self.settings.aois.batch_size
+                batches = [
+                    (
+                        collection_config.id,
+                        range(i, min(i + batch_size, len(features))),
                     )
+                    for collection_config in self.settings.collections
+                    for i in range(0, len(features), batch_size)
+                ]
+                batch_results = concurrent_map(
+                    lambda batch: self.search_aoi_items_batched(
+                        batch[0],
+                        base_cqls[batch[0]],
+                        search_afters[batch[0]],
+                        features,
+                        search_geometries,
+                        aoi_index,
+                        batch[1],
+                    ),
+                    batches,
+                    self.settings.max_search_concurrency,
+                )
+                for (collection_id, _), batch_items in zip(batches, batch_results):
+                    aoi_items.setdefault(collection_id, []).extend(batch_items)
+            else:
+                # Items found with simplified geometries are checked against
+                # the AOI geometries.
+                aoi_geometries: List[Optional[PreparedGeometry]] = [None] * len(
+                    features
+                )
+                if self.settings.aois.simplifies_search():
+                    aoi_geometries = list(aoi_registry.get_index().prepared)
+                aoi_searches = [
+                    (collection_config.id, i)
+                    for collection_config in self.settings.collections
+                    for i in range(len(features))
+                ]
+                results = concurrent_map(
+                    lambda search: self.search_aoi_item(
+                        search[0],
+                        base_cqls[search[0]],
+                        search_afters[search[0]],
+                        features[search[1]],
+                        search_geometries[search[1]],
+                        aoi_geometries[search[1]],
+                    ),
+                    aoi_searches,
+                    self.settings.max_search_concurrency,
+                )
+                for (collection_id, _), aoi_item in zip(aoi_searches, results):
                     if aoi_item:
-                        # Check if the item was already used.
-                        this_dt = get_datetime(aoi_item)
-                        last_dt: Optional[datetime] = None
-                        if AOI_LAST_ITEM_DT_KEY in feature["properties"]:
-                            last_dt = datetime.fromisoformat(
-                                feature["properties"].get(AOI_LAST_ITEM_DT_KEY)
-                            )
-                        if not last_dt or this_dt > last_dt:
-                            print(f"Found new item that intersects AOI {aoi_id}...")
-                            aoi_item.properties["aoi"] = aoi_id
-                            aoi_item.properties["aoi_geom"] = feature["geometry"]
-                            target_aoi_items.append(aoi_item)
+                        aoi_items.setdefault(collection_id, []).append(aoi_item)
+
+        for collection_config in self.settings.collections:
+            collection_id = collection_config.id
+            target_aoi_items.extend(aoi_items.get(collection_id, []))
 
             if not target_aoi_items:
                 print("Finding random items...")
-                items = client.search(
-                    filter=cql_add_after_arg(base_cql, search_after),
-                    max_items=self.settings.max_search_results,
-                ).get_all_items()
+                item_dicts, found, _ = self.search_item_dicts(
+                    collection_id,
+                    cql_add_after_arg(
+                        base_cqls[collection_id], search_afters[collection_id]
+                    ),
+                    self.settings.max_search_results,
+                    sample_size=self.settings.random_sample_size,
+                    project=True,
+                )
+                items = [item_from_dict(d) for d in item_dicts]
 
                 if not items:
                     print(f"WARNING: No items found. Skipping {collection_id}.")
 
-                print(f"Found {len(items)} items")
-                if len(items) == self.settings.max_search_results:
+                print(f"Found {found} items")
+                if found == self.settings.max_search_results:
                     print("(limit hit)")
 
                 target_random_items.extend(items)
 
         return target_aoi_items or target_random_items
 
+    def load_aoi_features(self, aoi_registry: AOIRegistry) -> List[Dict[str, Any]]:
+        """Copy the AOI features of a registry, with their state set.
+
+        Last item datetimes written into the feature collection by
+        earlier versions are used for AOIs that have no stored state.
+        """
+        assert self.aoi_state
+        last_item_datetimes = self.aoi_state.get_last_item_datetimes()
+        features: List[Dict[str, Any]] = []
+        # Copy the registry's features, which are shared between runs.
+        for registry_feature in aoi_registry.features:
+            feature = {
+                **registry_feature,
+                "properties": dict(registry_feature["properties"]),
+            }
+            if feature["id"] in last_item_datetimes:
+                feature["properties"][AOI_LAST_ITEM_DT_KEY] = last_item_datetimes[
+                    feature["id"]
+                ]
+            features.append(feature)
+        return features
+
     def set_aoi_item_info(self, item: pystac.Item) -> None:
-        # Set the properties of an AOI to
-        if self.settings.aois:
-            aoi_id = item.properties["aoi"]
-            item_dt = get_datetime(item)
-            fc_path = self.settings.aois.feature_collection_path
-            with open(fc_path) as f:
-                feature_collection = json.load(f)
-            for feature in feature_collection["features"]:
-                if feature["id"] == aoi_id:
-                    feature["properties"][AOI_LAST_ITEM_DT_KEY] = item_dt.isoformat()
-            with open(fc_path, "w") as f:
-                json.dump(feature_collection, f, indent=2)
+        # Record the item used for an AOI, so only newer items are used.
+        if self.aoi_state:
+            self.aoi_state.set_last_item_datetime(
+                item.properties["aoi"], get_datetime(item)
+            )
+
+    def get_outputs(self, output_paths: OutputPaths) -> List[OutputConfig]:
+        """Get every image to save from a render, including the thumbnail."""
+        outputs = [
+            OutputConfig(
+                path=str(output_paths.image),
+                width=self.settings.width,
+                height=self.settings.height,
+                mirror=self.settings.mirror_image,
+                encoder=self.settings.encoder,
+            ),
+            OutputConfig(
+                path=str(output_paths.thumbnail),
+                width=self.settings.thumbnail_width,
+                height=self.settings.thumbnail_height,
+                encoder=self.settings.encoder,
+            ),
+        ]
+        for output, path in zip(self.settings.outputs, output_paths.outputs):
+            outputs.append(
+                output.copy(
+                    update={
+                        "path": str(path),
+                        "encoder": output.encoder or self.settings.encoder,
+                    }
+                )
+            )
+        return outputs
+
+    def get_process_pool(self) -> ProcessPoolExecutor:
+        with self._process_pool_lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.settings.postprocess_workers
+                )
+            return self._process_pool
+
+    def save_outputs(self, rgb_image: PILImage, output_paths: OutputPaths) -> None:
+        outputs = self.get_outputs(output_paths)
+        for output in outputs:
+            Path(output.path).parent.mkdir(parents=True, exist_ok=True)
+        if self.settings.postprocess_workers > 0:
+            # Each output is saved by its own job, so the outputs of a render
+            # are saved concurrently. Jobs read the image from shared memory.
+            shared_memory = copy_to_shared_memory(rgb_image)
+            try:
+                futures = [
+                    self.get_process_pool().submit(
+                        run_post_process_job,
+                        PostProcessJob(
+                            shared_memory_name=shared_memory.name,
+                            size=rgb_image.size,
+                            output=output,
+                        ),
+                    )
+                    for output in outputs
+                ]
+                wait(futures)
+                for future in futures:
+                    future.result()
+            finally:
+                shared_memory.close()
+                shared_memory.unlink()
+            return
+        # Pillow releases the GIL while resizing and encoding, so the
+        # outputs are saved concurrently.
+        concurrent_map(
+            lambda output: save_output(rgb_image, output),
+            outputs,
+            min(len(outputs), os.cpu_count() or 1),
+        )
+
+    def has_staged_background(self) -> bool:
+        staged_paths = self.settings.get_staged_output_paths()
+        return staged_paths.image.exists() and staged_paths.info.exists()
+
+    def install_background(self, source_paths: OutputPaths) -> None:
+        """Move a background rendered ahead of time into place."""
+        output_paths = self.settings.get_output_paths()
+        os.replace(source_paths.image, output_paths.image)
+        if source_paths.thumbnail.exists():
+            os.replace(source_paths.thumbnail, output_paths.thumbnail)
+        for source_path, path in zip(source_paths.outputs, output_paths.outputs):
+            if source_path.exists():
+                os.replace(source_path, path)
+        image_info = ImageInfo.parse_file(source_paths.info)
+        image_info.last_changed = datetime.now()
+        write_text_atomic(output_paths.info, image_info.json(indent=2))
+        source_paths.info.unlink()
+
+    def get_pool_entries(self) -> List[OutputPaths]:
+        """Get the backgrounds in the rotation pool, oldest first."""
+        folder = self.settings.get_pool_folder()
+        if not folder.exists():
+            return []
+        entries = [
+            self.settings.get_output_paths_in(entry_folder)
+            for entry_folder in sorted(folder.iterdir())
+            if entry_folder.is_dir()
+        ]
+        # The info file is written last, so entries without one are incomplete.
+        return [entry for entry in entries if entry.info.exists()]
+
+    def fill_pool(self, count: int, output_paths: Optional[OutputPaths] = None) -> None:
+        """Render a batch of backgrounds into the rotation pool from one search.
+
+        If output_paths is given, a background is also rendered there from
+        the same search, and failing to render it is an error.
+        """
+        if not self.settings.pool:
+            raise SettingsError("A pool must be configured to render batches")
+        print(f"Rendering {count} backgrounds into the pool...")
+        search_timings: Dict[str, float] = {}
+        render_params_futures, candidates = self.find_candidates(search_timings)
+        pool_folder = self.settings.get_pool_folder()
+        entries = [
+            self.settings.get_output_paths_in(
+                pool_folder / f"{datetime.now():%Y%m%d%H%M%S}-{uuid4().hex[:8]}"
+            )
+            for _ in range(count)
+        ]
+        if output_paths:
+            entries.insert(0, output_paths)
+        entries = entries[: len(candidates)]
+        # Give each render its own distinct candidates to try.
+        random.shuffle(candidates)
+        batches = [candidates[i :: len(entries)] for i in range(len(entries))]
+
+        def render_entry(i: int) -> bool:
+            try:
+                self.render_candidates(
+                    batches[i],
+                    entries[i],
+                    render_params_futures,
+                    dict(search_timings),
+                )
+                return True
+            except Exception as e:
+                if entries[i] is output_paths:
+                    raise
+                print(f"WARNING: Could not render pool background: {e}")
+                return False
+
+        rendered = concurrent_map(render_entry, range(len(entries)), len(entries))
+        if output_paths:
+            rendered = rendered[1:]
+        print(f"Rendered {sum(rendered)} backgrounds into the pool")
 
     def generate(self) -> bool:
         if self.force:
@@ -364,32 +1907,58 @@ class TeamsBackgroundGenerator:
         else:
             if not self.should_generate_new_background():
                 print("No need to generate new background")
+                if self.settings.prefetch and not self.has_staged_background():
+                    print("Prefetching next background...")
+                    self.render_background(self.settings.get_staged_output_paths())
                 return False
 
-        fc_path: Optional[Path] = None
-        if self.settings.aois:
-            fc_path = Path(self.settings.aois.feature_collection_path)
-            ensure_ids(fc_path)
+        if self.settings.pool:
+            pool_entries = self.get_pool_entries()
+            if pool_entries:
+                print("Rotating in background from the pool...")
+                self.install_background(pool_entries[0])
+                shutil.rmtree(pool_entries[0].info.parent, ignore_errors=True)
+                if len(pool_entries) - 1 < self.settings.pool.low_water_mark:
+                    self.fill_pool(self.settings.pool.batch_size)
+            else:
+                # Render the background and refill the pool from one search.
+                self.fill_pool(
+                    self.settings.pool.batch_size, self.settings.get_output_paths()
+                )
+        elif self.settings.prefetch and self.has_staged_background():
+            print("Swapping in prefetched background...")
+            self.install_background(self.settings.get_staged_output_paths())
+        else:
+            self.render_background(self.settings.get_output_paths())
 
-        image_info: Optional[ImageInfo] = None
-        image_info_path = self.settings.get_image_info_path()
-        if image_info_path.exists():
-            image_info = ImageInfo.parse_file(image_info_path)
+        if self.settings.prefetch and not self.settings.pool:
+            print("Prefetching next background...")
+            self.render_background(self.settings.get_staged_output_paths())
+        print("Done.")
+        return True
 
-        target_item = random.choice(self.get_target_items())
-        is_aoi = False
+    def render_item(
+        self,
+        target_item: pystac.Item,
+        render_params_futures: Dict[str, "Future[str]"],
+        timings: Dict[str, float],
+    ) -> Tuple[PILImage, pystac.Item, Dict[str, Any], str]:
+        """Render the image for a target item.
+
+        Returns the image, the full target item, and the CQL and render
+        params used to render it. Stage timings are recorded in timings.
+        """
+        # Search results only lack assets if they were projected.
+        if self.settings.project_search_fields and not target_item.assets:
+            with time_stage(timings, "item"):
+                target_item = self.get_full_item(target_item)
         if target_item.properties.get("aoi"):
-            is_aoi = True
-            self.set_aoi_item_info(target_item)
             target_geom: Dict[str, Any] = target_item.properties["aoi_geom"]
         else:
             if not target_item.geometry:
                 raise Exception(f"Item {target_item.id} has no geometry")
             target_geom = target_item.geometry
 
-        if not target_item:
-            raise Exception("ERROR: No target item found!")
-
         collection_id = target_item.collection_id
         assert collection_id
 
@@ -397,28 +1966,109 @@ class TeamsBackgroundGenerator:
         render_options = collection_config.rendering_option
 
         print("Generating background image...")
-        bg_geom = self.get_bg_geom(target_geom)
-        render_params = self.get_render_params(collection_id, render_options)
+        if target_item.properties.get("aoi"):
+            bg_geom = self.get_aoi_bg_geom(target_item.properties["aoi"], target_geom)
+        else:
+            bg_geom = self.get_bg_geom(target_geom)
+        with time_stage(timings, "render_params"):
+            if collection_id in render_params_futures:
+                render_params = render_params_futures[collection_id].result()
+            else:
+                render_params = self.get_render_params(collection_id, render_options)
         cql = self.get_base_cql(collection_id, collection_config.filters)
 
+        cols, rows = self.settings.get_render_size()
         request_data: Dict[str, Any] = {
             "cql": cql,
             "geometry": bg_geom,
             "showBranding": self.settings.show_branding,
             "render_params": render_params + f"&collection={collection_id}",
-            "cols": self.settings.width,
-            "rows": self.settings.height,
+            "cols": cols,
+            "rows": rows,
         }
 
-        image = self.fetch_image(request_data)
-        bg_image = image
-        if self.settings.mirror_image:
-            bg_image = ImageOps.mirror(bg_image)
-        bg_image.convert("RGB").save(self.settings.get_image_path())
-        thumbnail = image.resize(
-            (self.settings.thumbnail_width, self.settings.thumbnail_height)
-        )
-        thumbnail.convert("RGB").save(self.settings.get_thumbnail_path())
+        with time_stage(timings, "fetch_image"):
+            image = self.render_image(request_data)
+        return image, target_item, cql, render_params
+
+    def check_image(self, image: PILImage) -> Optional[str]:
+        """Get the reason a rendered image should be rejected, if any."""
+        if self.settings.quality:
+            rejection = self.settings.quality.check(score_image(image))
+            if rejection:
+                return rejection
+        if self.hash_index and self.settings.dedup:
+            distance = self.hash_index.min_distance(dhash(image))
+            if distance is not None and distance <= self.settings.dedup.max_distance:
+                return f"too similar to a recent background (distance {distance})"
+        return None
+
+    def record_image(self, image: PILImage) -> None:
+        """Record an accepted image."""
+        if self.hash_index:
+            self.hash_index.add(dhash(image))
+
+    def find_candidates(
+        self, timings: Dict[str, float]
+    ) -> Tuple[Dict[str, "Future[str]"], List[pystac.Item]]:
+        """Search for candidate target items.
+
+        Also returns futures for the render params of each collection, if
+        they are being fetched during the search.
+        """
+        # Render params only depend on the collection, so they can be
+        # fetched while searching for the target item.
+        render_params_futures: Dict[str, "Future[str]"] = {}
+        if self.settings.pipeline_render_params:
+            render_params_futures = self.prefetch_render_params()
+        elif self.render_options_cache:
+            self.warm_render_options()
+
+        with time_stage(timings, "search"):
+            candidates = self.get_target_items()
+        if not candidates:
+            raise Exception("ERROR: No target item found!")
+        return render_params_futures, candidates
+
+    def render_background(self, output_paths: OutputPaths) -> None:
+        """Select a target item and render a background to the output paths."""
+        timings: Dict[str, float] = {}
+        render_params_futures, candidates = self.find_candidates(timings)
+        # Try candidates in random order until an acceptable image is rendered.
+        random.shuffle(candidates)
+        self.render_candidates(candidates, output_paths, render_params_futures, timings)
+
+    def render_candidates(
+        self,
+        candidates: List[pystac.Item],
+        output_paths: OutputPaths,
+        render_params_futures: Dict[str, "Future[str]"],
+        timings: Dict[str, float],
+    ) -> None:
+        """Render the first acceptable candidate to the output paths."""
+        for candidate in candidates[: self.settings.max_render_attempts]:
+            image, target_item, cql, render_params = self.render_item(
+                candidate, render_params_futures, timings
+            )
+            rejection = self.check_image(image)
+            if not rejection:
+                break
+            print(f"Rejected image of {target_item.id}: {rejection}")
+        else:
+            raise Exception("ERROR: No acceptable background image was rendered")
+
+        self.record_image(image)
+        is_aoi = False
+        if target_item.properties.get("aoi"):
+            is_aoi = True
+            self.set_aoi_item_info(target_item)
+
+        with time_stage(timings, "save"):
+            # Convert once; the background and thumbnail both derive from
+            # the RGB image, and the decoded image can be freed.
+            rgb_image = to_rgb(image)
+            del image
+            self.save_outputs(rgb_image, output_paths)
 
         print("Writing info...")
         image_info = ImageInfo(
@@ -428,22 +2078,38 @@ class TeamsBackgroundGenerator:
             is_aoi=is_aoi,
             last_changed=datetime.now(),
         )
-        with open(self.settings.get_image_info_path(), "w") as f:
-            f.write(image_info.json(indent=2))
-        print("Done.")
-        return True
+        write_text_atomic(output_paths.info, image_info.json(indent=2))
+        print(
+            "Stage timings: " + ", ".join(f"{k} {v:.2f}s" for k, v in timings.items())
+        )
 
 
 if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument("-f", "--force", action="store_true")
     arg_parser.add_argument("-d", "--debug", action="store_true")
+    arg_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Bypass the search and render options caches",
+    )
+    arg_parser.add_argument(
+        "--batch",
+        type=int,
+        metavar="N",
+        help="Render N backgrounds into the rotation pool",
+    )
 
     args = arg_parser.parse_args()
     settings = Settings.load()
-    generator = TeamsBackgroundGenerator(settings, args.force)
+    generator = TeamsBackgroundGenerator(
+        settings, args.force, use_cache=not args.no_cache
+    )
     try:
-        generator.generate()
+        if args.batch:
+            generator.fill_pool(args.batch)
+        else:
+            generator.generate()
     except Exception as e:
         if args.debug:
             raise
@@ -0,0 +1,19 @@
+from typing import Any, Iterator, List, Optional
+
+import pytest
+from helpers import FakeSTACAPI, start_fake_api
+
+
+@pytest.fixture
+def fake_api_factory() -> Iterator[Any]:
+    servers: List[FakeSTACAPI] = []
+
+    def start(conforms_to: Optional[List[str]]) -> FakeSTACAPI:
+        server = start_fake_api(conforms_to)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,200 @@
+"""Helpers shared by the tests, including a local stand-in STAC API."""
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import requests
+from PIL import Image
+from shapely.geometry import box, mapping, shape
+
+from pc_teams_background import Settings
+
+
+def make_settings(tmp_path: Path, **kwargs) -> Settings:
+    return Settings(
+        teams_image_folder=str(tmp_path),
+        collections=[{"id": "sentinel-2-l2a"}],
+        width=1040,
+        height=780,
+        thumbnail_width=200,
+        thumbnail_height=150,
+        apis={
+            "stac": "https://example.com/stac",
+            "info": "https://example.com/info",
+            "image": "https://example.com/image",
+        },
+        **kwargs,
+    )
+
+
+def make_image(width: int, height: int) -> Image.Image:
+    gradient = np.linspace(0, 255, width, dtype=np.uint8)
+    pixels = np.zeros((height, width, 3), dtype=np.uint8)
+    pixels[..., 0] = gradient
+    pixels[..., 1] = gradient[::-1]
+    pixels[..., 2] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+    return Image.fromarray(pixels)
+
+
+def make_noise_image(width: int, height: int, seed: int = 0) -> Image.Image:
+    """Make an image that compresses poorly, for large encoded payloads."""
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def make_response(payload: bytes) -> requests.Response:
+    """Make a streamed response with the given body."""
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.raw = io.BytesIO(payload)
+    return resp
+
+
+def find_geometries(cql: Any) -> List[Dict[str, Any]]:
+    """Find the geometries of the s_intersects ops in a CQL2 filter."""
+    if isinstance(cql, list):
+        return [geom for arg in cql for geom in find_geometries(arg)]
+    if not isinstance(cql, dict):
+        return []
+    if cql.get("op") == "s_intersects":
+        return [cql["args"][1]]
+    return find_geometries(list(cql.values()))
+
+
+class FakeSTACAPI(ThreadingHTTPServer):
+    """A STAC API that answers searches with the items intersecting them.
+
+    It also serves mosaic info at /info, honouring conditional requests.
+    """
+
+    # Accept many concurrent connections without dropping any.
+    request_queue_size = 128
+
+    def __init__(self, conforms_to: Optional[List[str]]):
+        super().__init__(("127.0.0.1", 0), FakeSTACAPIHandler)
+        self.url = f"http://127.0.0.1:{self.server_port}"
+        self.conforms_to = conforms_to
+        self.items: List[Dict[str, Any]] = []
+        self.search_bodies: List[Dict[str, Any]] = []
+        self.mosaic_info: Dict[str, Any] = {"render_options": []}
+        self.mosaic_info_etag = '"1"'
+        self.mosaic_info_last_modified = "Tue, 01 Nov 2022 00:00:00 GMT"
+        self.info_request_headers: List[Dict[str, str]] = []
+        # Seconds to wait before answering each search.
+        self.latency = 0.0
+
+
+class FakeSTACAPIHandler(BaseHTTPRequestHandler):
+    server: FakeSTACAPI
+
+    def send_json(
+        self, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None
+    ) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_mosaic_info(self) -> None:
+        self.server.info_request_headers.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == self.server.mosaic_info_etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_json(
+            self.server.mosaic_info,
+            {
+                "ETag": self.server.mosaic_info_etag,
+                "Last-Modified": self.server.mosaic_info_last_modified,
+            },
+        )
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/info"):
+            self.send_mosaic_info()
+            return
+        url = self.server.url
+        landing: Dict[str, Any] = {
+            "type": "Catalog",
+            "id": "fake",
+            "description": "A fake STAC API",
+            "stac_version": "1.0.0",
+            "links": [
+                {"rel": "self", "href": url},
+                {"rel": "root", "href": url},
+                {
+                    "rel": "search",
+                    "type": "application/geo+json",
+                    "href": f"{url}/search",
+                    "method": "POST",
+                },
+            ],
+        }
+        if self.server.conforms_to is not None:
+            landing["conformsTo"] = self.server.conforms_to
+        self.send_json(landing)
+
+    def do_POST(self) -> None:
+        length = int(self.headers["Content-Length"])
+        body = json.loads(self.rfile.read(length))
+        self.server.search_bodies.append(body)
+        time.sleep(self.server.latency)
+        geoms = [shape(geom) for geom in find_geometries(body.get("filter"))]
+        items = [
+            item
+            for item in self.server.items
+            if not geoms or any(shape(item["geometry"]).intersects(g) for g in geoms)
+        ]
+        if body.get("sortby"):
+            # Only newest first sorting is used.
+            items = sorted(items, key=lambda i: i["properties"]["datetime"])[::-1]
+        self.send_json({"type": "FeatureCollection", "features": items})
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+STAC_API_CONFORMANCE = [
+    "https://api.stacspec.org/v1.0.0-rc.1/core",
+    "https://api.stacspec.org/v1.0.0-rc.1/item-search",
+    "https://api.stacspec.org/v1.0.0-rc.1/item-search#filter",
+]
+
+
+def make_item_dict(item_id: str, dt: str, bbox: List[float]) -> Dict[str, Any]:
+    return {
+        "type": "Feature",
+        "stac_version": "1.0.0",
+        "id": item_id,
+        "collection": "sentinel-2-l2a",
+        "geometry": mapping(box(*bbox)),
+        "bbox": bbox,
+        "properties": {"datetime": dt},
+        "links": [],
+        "assets": {"visual": {"href": f"{item_id}.tif"}},
+    }
+
+
+def make_aoi_file(path: Path, geometries: List[Any]) -> Path:
+    """Write AOIs with the given shapely geometries, with IDs aoi-0, aoi-1..."""
+    features = [
+        {"type": "Feature", "id": f"aoi-{i}", "geometry": mapping(geom)}
+        for i, geom in enumerate(geometries)
+    ]
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+    return path
+
+
+def start_fake_api(conforms_to: Optional[List[str]]) -> FakeSTACAPI:
+    server = FakeSTACAPI(conforms_to)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
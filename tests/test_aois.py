@@ -0,0 +1,161 @@
+from datetime import datetime, timedelta
+
+import pystac
+import pytest
+from shapely.geometry import Point, box, mapping, shape
+
+from helpers import (
+    STAC_API_CONFORMANCE,
+    make_aoi_file,
+    make_item_dict,
+    make_settings,
+)
+from pc_teams_background import (
+    AOIIndex,
+    AOIRegistry,
+    TeamsBackgroundGenerator,
+    count_vertices,
+    simplify_geometry,
+)
+
+
+def test_aoi_index_queries():
+    features = [
+        {"id": "a", "geometry": mapping(box(0, 0, 1, 1))},
+        {"id": "b", "geometry": mapping(box(2, 0, 3, 1))},
+        {"id": "c", "geometry": mapping(Point(5, 5).buffer(1))},
+    ]
+    index = AOIIndex(features)
+    assert index.query(box(0.5, 0.5, 2.5, 0.6)) == [0, 1]
+    assert index.query_bbox([10, 10, 11, 11]) == []
+    # Bounding boxes overlap, but the geometries don't.
+    assert index.query_bbox([5.8, 5.8, 6.2, 6.2]) == []
+    item = pystac.Item(
+        "item",
+        mapping(box(4.5, 4.5, 5.5, 5.5)),
+        [4.5, 4.5, 5.5, 5.5],
+        datetime(2022, 11, 1),
+        {},
+    )
+    assert index.query_item(item) == [2]
+
+
+def test_simplify_geometry_fits_vertex_budget():
+    circle = Point(0, 0).buffer(1, resolution=64)
+    assert count_vertices(circle) > 100
+    simplified = simplify_geometry(circle, max_vertices=20)
+    assert count_vertices(simplified) <= 20
+    assert simplified.area == pytest.approx(circle.area, rel=0.1)
+
+
+def test_simplify_geometry_fallback():
+    circle = Point(0, 0).buffer(1, resolution=64)
+    # A polygon can't have 3 vertices, so without a fallback the most
+    # simplified geometry is kept.
+    simplified = simplify_geometry(circle, max_vertices=3)
+    assert 3 < count_vertices(simplified) < count_vertices(circle)
+    assert simplify_geometry(circle, max_vertices=3, fallback="bbox").equals(
+        box(-1, -1, 1, 1)
+    )
+    assert simplify_geometry(circle) is circle
+
+
+@pytest.mark.parametrize("batch_search", [True, False])
+def test_simplified_aoi_search_checks_aoi_geometry(
+    tmp_path, fake_api_factory, batch_search
+):
+    circle = Point(0, 0).buffer(1, resolution=64)
+    aoi_path = make_aoi_file(tmp_path / "aois.geojson", [circle])
+    api = fake_api_factory(STAC_API_CONFORMANCE)
+    recent = datetime.utcnow() - timedelta(days=1)
+    api.items = [
+        make_item_dict(
+            "inside",
+            f"{recent - timedelta(hours=1):%Y-%m-%dT%H:%M:%SZ}",
+            [-0.1, -0.1, 0.1, 0.1],
+        ),
+        # Within the AOI's bounding box, but outside the AOI.
+        make_item_dict("corner", f"{recent:%Y-%m-%dT%H:%M:%SZ}", [0.8, 0.8, 1, 1]),
+    ]
+    settings = make_settings(
+        tmp_path,
+        aois={
+            "feature_collection_path": str(aoi_path),
+            "batch_search": batch_search,
+            "search_max_vertices": 3,
+            "search_simplify_fallback": "bbox",
+        },
+    )
+    settings.apis.stac = api.url
+    items = TeamsBackgroundGenerator(settings).get_target_items()
+    assert [(item.id, item.properties["aoi"]) for item in items] == [
+        ("inside", "aoi-0")
+    ]
+
+
+@pytest.mark.parametrize("batch_search", [True, False])
+def test_concurrent_aoi_searches_match_serial_searches(
+    tmp_path, fake_api_factory, batch_search
+):
+    aoi_path = make_aoi_file(
+        tmp_path / "aois.geojson", [box(2 * i, 0, 2 * i + 1, 1) for i in range(6)]
+    )
+    api = fake_api_factory(
+        STAC_API_CONFORMANCE + ["https://api.stacspec.org/v1.0.0-rc.1/item-search#sort"]
+    )
+    now = datetime.utcnow()
+    # AOI i has i % 3 items, so some AOIs have none.
+    api.items = [
+        make_item_dict(
+            f"item-{i}-{j}",
+            f"{now - timedelta(days=j + 1):%Y-%m-%dT%H:%M:%SZ}",
+            [2 * i, 0, 2 * i + 1, 1],
+        )
+        for i in range(6)
+        for j in range(i % 3)
+    ]
+
+    def get_target_items(max_search_concurrency):
+        settings = make_settings(
+            tmp_path,
+            max_search_concurrency=max_search_concurrency,
+            aois={
+                "feature_collection_path": str(aoi_path),
+                "batch_search": batch_search,
+                "batch_size": 2,
+            },
+        )
+        settings.apis.stac = api.url
+        items = TeamsBackgroundGenerator(settings).get_target_items()
+        return [(item.id, item.properties["aoi"]) for item in items]
+
+    serial = get_target_items(1)
+    assert serial == [
+        ("item-1-0", "aoi-1"),
+        ("item-2-0", "aoi-2"),
+        ("item-4-0", "aoi-4"),
+        ("item-5-0", "aoi-5"),
+    ]
+    assert get_target_items(8) == serial
+
+
+def test_aoi_registry_is_loaded_once_per_search(tmp_path, monkeypatch):
+    aoi_path = make_aoi_file(
+        tmp_path / "aois.geojson", [box(0, 0, 2, 1), box(10, 10, 11, 11)]
+    )
+    settings = make_settings(tmp_path, aois={"feature_collection_path": str(aoi_path)})
+    generator = TeamsBackgroundGenerator(settings)
+    monkeypatch.setattr(generator, "search_aoi_item", lambda *args: None)
+    loads = []
+    load = AOIRegistry.load
+    monkeypatch.setattr(
+        AOIRegistry, "load", lambda path: loads.append(path) or load(path)
+    )
+    monkeypatch.setattr(generator, "search_item_dicts", lambda *a, **kw: ([], 0, False))
+    assert generator.get_target_items() == []
+    assert len(loads) == 1
+
+    # AOI frames come from the registry's bounds, without parsing geometries.
+    frame = shape(generator.get_aoi_bg_geom("aoi-0", {}))
+    assert frame.equals(shape(generator.get_bg_geom(mapping(box(0, 0, 2, 1)))))
+    assert frame.bounds[0] == 0 and frame.bounds[2] == 2
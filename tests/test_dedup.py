@@ -0,0 +1,23 @@
+from PIL import Image
+
+from helpers import make_image
+from pc_teams_background import ImageHashIndex, dhash
+
+
+def test_dhash_distances(tmp_path):
+    image = make_image(320, 240)
+    image_hash = dhash(image)
+    assert dhash(image.resize((160, 120))) == image_hash
+
+    hash_index = ImageHashIndex(tmp_path / "hashes.npy", history_size=2)
+    assert hash_index.min_distance(image_hash) is None
+    hash_index.add(image_hash)
+    assert hash_index.min_distance(image_hash) == 0
+    flipped_hash = dhash(image.transpose(Image.Transpose.FLIP_LEFT_RIGHT))
+    assert hash_index.min_distance(flipped_hash) > 10
+
+    # The index is persisted and capped at the history size.
+    hash_index.add(flipped_hash)
+    hash_index.add(flipped_hash)
+    reloaded = ImageHashIndex(tmp_path / "hashes.npy", history_size=2)
+    assert reloaded.min_distance(image_hash) > 10
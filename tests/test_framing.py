@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from pc_teams_background import frame_bounds
+
+
+def test_frame_bounds_degrees_matches_width():
+    frames = frame_bounds(np.array([[10.0, 60.0, 12.0, 60.5]]), 0.75)
+    np.testing.assert_allclose(frames, [[10.0, 59.5, 12.0, 61.0]])
+
+
+@pytest.mark.parametrize("framing", ["web_mercator", "equidistant"])
+def test_frame_bounds_metric_contains_bounds(framing):
+    bounds = np.array([[10.0, 60.0, 11.0, 60.2], [-1.0, -0.1, 1.0, 0.1]])
+    frames = frame_bounds(bounds, 0.75, framing)
+    assert frames.shape == (2, 4)
+    assert np.all(frames[:, :2] <= bounds[:, :2] + 1e-9)
+    assert np.all(frames[:, 2:] >= bounds[:, 2:] - 1e-9)
+    # Near the equator, ground distances are close to raw degrees.
+    np.testing.assert_allclose(frames[1], [-1.0, -0.75, 1.0, 0.75], atol=1e-2)
+    # At 60 degrees north, a degree of longitude is about half a degree
+    # of latitude on the ground, so the frame is about half as tall.
+    height = frames[0, 3] - frames[0, 1]
+    assert 0.3 < height < 0.45
+
+
+@pytest.mark.parametrize("framing", ["web_mercator", "equidistant"])
+def test_frame_bounds_clamps_ground_extent(framing):
+    frames = frame_bounds(np.array([[-1.0, -1.0, 1.0, 1.0]]), 0.75, framing, 50_000)
+    width_km = (frames[0, 2] - frames[0, 0]) * 111.32
+    assert width_km == pytest.approx(50, rel=0.01)
+    center = (frames[0, :2] + frames[0, 2:]) / 2
+    np.testing.assert_allclose(center, [0.0, 0.0], atol=1e-9)
@@ -0,0 +1,302 @@
+import io
+import math
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+from PIL import Image
+from shapely.geometry import box, mapping
+
+from helpers import (
+    STAC_API_CONFORMANCE,
+    make_image,
+    make_item_dict,
+    make_noise_image,
+    make_response,
+    make_settings,
+)
+from pc_teams_background import (
+    IMAGE_SPOOL_SIZE,
+    SHARED_IMAGE_STRIP_SIZE,
+    AOIIndex,
+    TeamsBackgroundGenerator,
+    copy_to_shared_memory,
+    item_from_dict,
+    read_from_shared_memory,
+    score_image,
+    to_rgb,
+)
+
+
+def test_item_from_dict_parses_projected_items():
+    item = item_from_dict(
+        {
+            "id": "item",
+            "collection": "sentinel-2-l2a",
+            "geometry": mapping(box(0, 0, 1, 1)),
+            "bbox": [0, 0, 1, 1],
+            "properties": {"datetime": "2022-11-01T00:00:00Z"},
+        }
+    )
+    assert item.id == "item"
+    assert item.collection_id == "sentinel-2-l2a"
+    assert item.datetime == datetime(2022, 11, 1, tzinfo=timezone.utc)
+    assert item.assets == {}
+
+
+def test_shared_memory_round_trip():
+    image = make_image(1000, 700)
+    shared_memory = copy_to_shared_memory(image)
+    try:
+        copy = read_from_shared_memory(shared_memory, image.size)
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+    assert copy.tobytes() == image.tobytes()
+
+
+@pytest.mark.parametrize("postprocess_workers", [0, 2])
+def test_save_outputs_makes_no_full_frame_copies(tmp_path, postprocess_workers):
+    """Saving every output from a render allocates no full-frame buffers.
+
+    Pillow's pixel buffers are not traced by tracemalloc, so this measures
+    the Python level copies (e.g. tobytes) that the pipeline must avoid, and
+    Pillow's own counter of new images covers the pixel buffers.
+    """
+    settings = make_settings(
+        tmp_path,
+        mirror_image=True,
+        postprocess_workers=postprocess_workers,
+        outputs=[{"path": str(tmp_path / "large.jpg"), "width": 1920, "height": 1080}],
+    )
+    generator = TeamsBackgroundGenerator(settings)
+    image = make_image(1920, 1440)
+    frame_bytes = image.width * image.height * 3
+
+    # Load the image plugins up front, so their imports aren't measured.
+    Image.init()
+    tracemalloc.start()
+    try:
+        before = Image.core.get_stats()["new_count"]
+        rgb_image = to_rgb(image)
+        converted = Image.core.get_stats()["new_count"]
+        generator.save_outputs(rgb_image, settings.get_output_paths())
+        saved = Image.core.get_stats()["new_count"]
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        if generator._process_pool:
+            generator._process_pool.shutdown()
+
+    assert rgb_image is image
+    assert converted == before
+    if postprocess_workers:
+        # Only the strips copied into shared memory are allocated here.
+        strip_rows = max(1, SHARED_IMAGE_STRIP_SIZE // (image.width * 3))
+        assert saved - converted == math.ceil(image.height / strip_rows)
+    else:
+        # Background: two resampling passes and the mirror. Thumbnail: reduce
+        # and two resampling passes. Large output: one resampling pass.
+        assert saved - converted == 7
+    assert peak < frame_bytes / 8
+    output_paths = settings.get_output_paths()
+    with Image.open(output_paths.image) as saved:
+        assert saved.size == (1040, 780)
+    with Image.open(output_paths.thumbnail) as saved:
+        assert saved.size == (200, 150)
+    with Image.open(output_paths.outputs[0]) as saved:
+        assert saved.size == (1920, 1080)
+
+
+def test_read_image_does_not_buffer_payload(tmp_path):
+    image = make_noise_image(1024, 1024)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    payload = buffer.getvalue()
+    assert len(payload) > 2 * IMAGE_SPOOL_SIZE
+    generator = TeamsBackgroundGenerator(make_settings(tmp_path))
+
+    Image.init()
+    tracemalloc.start()
+    try:
+        decoded = generator.read_image(make_response(payload))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert decoded.tobytes() == image.tobytes()
+    # Payloads past the spool size go to disk, so only the spooled part and
+    # a few chunks are held in memory.
+    assert peak < IMAGE_SPOOL_SIZE + len(payload) / 4
+
+    generator.settings.http.max_download_bytes = len(payload) // 2
+    with pytest.raises(Exception, match="larger than"):
+        generator.read_image(make_response(payload))
+
+
+@pytest.mark.parametrize("projected", [True, False])
+def test_render_item_only_refetches_projected_items(tmp_path, monkeypatch, projected):
+    generator = TeamsBackgroundGenerator(make_settings(tmp_path))
+    item = item_from_dict(
+        {
+            "id": "item",
+            "collection": "sentinel-2-l2a",
+            "geometry": mapping(box(0, 0, 1, 1)),
+            "bbox": [0, 0, 1, 1],
+            "properties": {"datetime": "2022-11-01T00:00:00Z"},
+            "assets": {} if projected else {"visual": {"href": "visual.tif"}},
+        }
+    )
+    full_item_ids = []
+
+    def get_full_item(item):
+        full_item_ids.append(item.id)
+        return item
+
+    monkeypatch.setattr(generator, "get_full_item", get_full_item)
+    monkeypatch.setattr(generator, "get_render_params", lambda *args: "assets=visual")
+    monkeypatch.setattr(generator, "render_image", lambda data: make_image(8, 6))
+    image, target_item, _, _ = generator.render_item(item, {}, {})
+    assert image.size == (8, 6)
+    assert target_item.id == "item"
+    assert full_item_ids == (["item"] if projected else [])
+
+
+def test_search_without_advertised_conformance(tmp_path, fake_api_factory):
+    # APIs with a search link but no conformsTo are searched as they are.
+    api = fake_api_factory(None)
+    api.items = [make_item_dict("item", "2022-11-01T00:00:00Z", [0, 0, 1, 1])]
+    settings = make_settings(tmp_path)
+    settings.apis.stac = api.url
+    generator = TeamsBackgroundGenerator(settings)
+    cql = generator.get_base_cql("sentinel-2-l2a", None)
+    items, found, _ = generator.search_item_dicts("sentinel-2-l2a", cql, max_items=10)
+    assert found == 1
+    assert items[0]["id"] == "item"
+    assert len(api.search_bodies) == 1
+
+
+@pytest.mark.parametrize("supports_sort", [True, False])
+def test_search_aoi_item_finds_newest_item(tmp_path, fake_api_factory, supports_sort):
+    conforms_to = list(STAC_API_CONFORMANCE)
+    if supports_sort:
+        conforms_to.append("https://api.stacspec.org/v1.0.0-rc.1/item-search#sort")
+    api = fake_api_factory(conforms_to)
+    api.items = [
+        make_item_dict("old", "2022-11-01T00:00:00Z", [0, 0, 1, 1]),
+        make_item_dict("new", "2022-11-03T00:00:00Z", [0, 0, 1, 1]),
+        make_item_dict("middle", "2022-11-02T00:00:00Z", [0, 0, 1, 1]),
+    ]
+    settings = make_settings(tmp_path)
+    settings.apis.stac = api.url
+    generator = TeamsBackgroundGenerator(settings)
+    feature = {"id": "aoi", "geometry": mapping(box(0, 0, 1, 1)), "properties": {}}
+    item = generator.search_aoi_item(
+        "sentinel-2-l2a",
+        generator.get_base_cql("sentinel-2-l2a", None),
+        "2022-10-01T00:00:00",
+        feature,
+        feature["geometry"],
+    )
+    assert item is not None
+    assert item.id == "new"
+    assert item.properties["aoi"] == "aoi"
+    assert ("sortby" in api.search_bodies[0]) == supports_sort
+
+
+def test_score_image_counts_nodata():
+    pixels = np.asarray(make_image(1920, 1080).convert("RGBA")).copy()
+    pixels[:540, :, 3] = 0
+    pixels[540:810, :, :3] = 0
+    quality = score_image(Image.fromarray(pixels))
+    assert quality.nodata_fraction == pytest.approx(0.75, abs=0.02)
+    assert quality.contrast > 0
+    assert 0 < quality.saturation <= 1
+
+
+def test_score_image_is_fast():
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (2160, 3840, 4), dtype=np.uint8)
+    image = Image.fromarray(pixels)
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        score_image(image)
+        timings.append(time.perf_counter() - start)
+    assert min(timings) < 0.01
+
+
+@pytest.mark.parametrize("supports_sort", [True, False])
+def test_batched_aoi_search_past_result_limit(
+    tmp_path, fake_api_factory, supports_sort
+):
+    conforms_to = list(STAC_API_CONFORMANCE)
+    if supports_sort:
+        conforms_to.append("https://api.stacspec.org/v1.0.0-rc.1/item-search#sort")
+    api = fake_api_factory(conforms_to)
+    api.items = [
+        make_item_dict("a-old", "2022-11-02T00:00:00Z", [0, 0, 1, 1]),
+        make_item_dict("b", "2022-11-01T00:00:00Z", [2, 0, 3, 1]),
+        make_item_dict("a-new", "2022-11-03T00:00:00Z", [0, 0, 1, 1]),
+    ]
+    settings = make_settings(tmp_path, max_search_results=2)
+    settings.apis.stac = api.url
+    generator = TeamsBackgroundGenerator(settings)
+    features = [
+        {"id": "a", "geometry": mapping(box(0, 0, 1, 1)), "properties": {}},
+        {"id": "b", "geometry": mapping(box(2, 0, 3, 1)), "properties": {}},
+    ]
+    items = generator.search_aoi_items_batched(
+        "sentinel-2-l2a",
+        generator.get_base_cql("sentinel-2-l2a", None),
+        "2022-10-01T00:00:00",
+        features,
+        [feature["geometry"] for feature in features],
+        AOIIndex(features),
+        range(2),
+    )
+    assert [(item.id, item.properties["aoi"]) for item in items] == [
+        ("a-new", "a"),
+        ("b", "b"),
+    ]
+    # With sorting, only the AOI without a match is searched again.
+    assert len(api.search_bodies) == (2 if supports_sort else 3)
+
+
+def test_generate_fills_empty_pool_from_one_search(tmp_path, monkeypatch):
+    settings = make_settings(tmp_path, pool={"batch_size": 2})
+    generator = TeamsBackgroundGenerator(settings)
+    candidates = [
+        item_from_dict(
+            make_item_dict(f"item-{i}", "2022-11-01T00:00:00Z", [0, 0, 1, 1])
+        )
+        for i in range(6)
+    ]
+    searches = []
+    render_timings = []
+
+    def get_target_items():
+        searches.append(True)
+        return list(candidates)
+
+    def render_item(target_item, render_params_futures, timings):
+        render_timings.append(timings)
+        timings["fetch_image"] = 0.0
+        return make_image(1040, 780), target_item, {}, "assets=visual"
+
+    monkeypatch.setattr(generator, "get_target_items", get_target_items)
+    monkeypatch.setattr(generator, "render_item", render_item)
+    assert generator.generate()
+
+    assert len(searches) == 1
+    assert settings.get_image_path().exists()
+    assert settings.get_image_info_path().exists()
+    assert len(generator.get_pool_entries()) == 2
+    # Each render records its timings separately.
+    assert len(render_timings) == 3
+    assert len({id(timings) for timings in render_timings}) == 3
+    assert all(
+        set(timings) == {"search", "fetch_image", "save"} for timings in render_timings
+    )
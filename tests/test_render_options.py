@@ -0,0 +1,56 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from helpers import make_settings
+from pc_teams_background import TeamsBackgroundGenerator
+
+
+def age_cache_entries(folder, age: timedelta) -> None:
+    for path in folder.glob("*.json"):
+        entry = json.loads(path.read_text())
+        entry["created"] = (datetime.now(tz=timezone.utc) - age).isoformat()
+        path.write_text(json.dumps(entry))
+
+
+def test_mosaic_info_is_revalidated(tmp_path, fake_api_factory):
+    api = fake_api_factory(None)
+    api.mosaic_info = {"render_options": [{"name": "natural", "options": "a"}]}
+    cache_folder = tmp_path / "render-options"
+    settings = make_settings(
+        tmp_path, render_options_cache={"folder": str(cache_folder), "ttl_hours": 1}
+    )
+    settings.apis.info = f"{api.url}/info"
+
+    def get_mosaic_info():
+        return TeamsBackgroundGenerator(settings).get_mosaic_info("sentinel-2-l2a")
+
+    assert get_mosaic_info() == api.mosaic_info
+    assert "If-None-Match" not in api.info_request_headers[0]
+    (entry_path,) = cache_folder.glob("*.json")
+    stored = json.loads(entry_path.read_text())["value"]
+    assert stored["etag"] == api.mosaic_info_etag
+    assert stored["last_modified"] == api.mosaic_info_last_modified
+
+    # Fresh entries are used without a request.
+    assert get_mosaic_info() == api.mosaic_info
+    assert len(api.info_request_headers) == 1
+
+    # Expired entries are revalidated, and a 304 refreshes them.
+    age_cache_entries(cache_folder, timedelta(hours=2))
+    assert get_mosaic_info() == api.mosaic_info
+    assert len(api.info_request_headers) == 2
+    assert api.info_request_headers[1]["If-None-Match"] == api.mosaic_info_etag
+    assert (
+        api.info_request_headers[1]["If-Modified-Since"]
+        == api.mosaic_info_last_modified
+    )
+    assert get_mosaic_info() == api.mosaic_info
+    assert len(api.info_request_headers) == 2
+
+    # A changed mosaic info replaces the entry.
+    age_cache_entries(cache_folder, timedelta(hours=2))
+    api.mosaic_info = {"render_options": [{"name": "natural", "options": "b"}]}
+    api.mosaic_info_etag = '"2"'
+    assert get_mosaic_info() == api.mosaic_info
+    stored = json.loads(entry_path.read_text())["value"]
+    assert stored["etag"] == '"2"'
@@ -0,0 +1,20 @@
+import numpy as np
+
+from pc_teams_background import reservoir_sample
+
+
+def test_reservoir_sample_keeps_everything_below_k():
+    sample, seen = reservoir_sample(iter(range(3)), 5)
+    assert sample == [0, 1, 2]
+    assert seen == 3
+
+
+def test_reservoir_sample_is_uniform():
+    counts = np.zeros(10)
+    for _ in range(2000):
+        sample, seen = reservoir_sample(iter(range(10)), 3)
+        assert seen == 10
+        assert len(set(sample)) == 3
+        counts[sample] += 1
+    # Each element is expected in 30% of samples.
+    assert np.all(np.abs(counts / 2000 - 0.3) < 0.05)
@@ -0,0 +1,126 @@
+import os
+from datetime import timedelta
+
+from shapely.geometry import box, mapping
+
+from helpers import STAC_API_CONFORMANCE, make_item_dict, make_settings
+from pc_teams_background import (
+    AOIIndex,
+    JSONFileCache,
+    TeamsBackgroundGenerator,
+    cache_key,
+    canonical_cql,
+)
+
+
+def test_canonical_cql_ignores_time_of_day():
+    def cql(start: str, end: str):
+        return {
+            "filter-lang": "cql2-json",
+            "filter": {
+                "op": "and",
+                "args": [
+                    {"op": "=", "args": [{"property": "collection"}, "c"]},
+                    {
+                        "op": "anyinteracts",
+                        "args": [{"property": "datetime"}, {"interval": [start, end]}],
+                    },
+                ],
+            },
+        }
+
+    morning = cql("2022-11-01T08:00:00", "2022-11-30T08:00:00")
+    evening = cql("2022-11-01T20:00:00", "2022-11-30T20:00:00")
+    assert canonical_cql(morning) == canonical_cql(evening)
+    assert canonical_cql(morning)["filter"]["args"][1]["args"][1] == {
+        "interval": ["2022-11-01", ".."]
+    }
+    assert cache_key(cql=canonical_cql(morning)) == cache_key(
+        cql=canonical_cql(evening)
+    )
+    next_day = cql("2022-11-02T08:00:00", "2022-12-01T08:00:00")
+    assert cache_key(cql=canonical_cql(morning)) != cache_key(
+        cql=canonical_cql(next_day)
+    )
+
+
+def test_json_file_cache_expires_entries(tmp_path):
+    cache = JSONFileCache(tmp_path, max_entries=10)
+    assert cache.get("key", timedelta(minutes=1)) is None
+    cache.put("key", {"items": [1, 2]})
+    assert cache.get("key", timedelta(minutes=1)) == {"items": [1, 2]}
+    assert cache.get("key", timedelta(0)) is None
+    # Expired entries are still available, e.g. for revalidation.
+    assert cache.get_entry("key")[1] == {"items": [1, 2]}
+
+
+def test_json_file_cache_evicts_least_recently_used(tmp_path):
+    cache = JSONFileCache(tmp_path, max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    os.utime(tmp_path / "a.json", (1000, 1000))
+    os.utime(tmp_path / "b.json", (2000, 2000))
+    # Reading an entry marks it as recently used.
+    assert cache.get("a", timedelta(days=1)) == 1
+    cache.put("c", 3)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a.json", "c.json"]
+    assert cache.get("b", timedelta(days=1)) is None
+
+
+def test_search_cache_can_be_disabled(tmp_path, fake_api_factory):
+    api = fake_api_factory(STAC_API_CONFORMANCE)
+    api.items = [make_item_dict("item", "2022-11-01T00:00:00Z", [0, 0, 1, 1])]
+    settings = make_settings(tmp_path, search_cache={"folder": str(tmp_path / "cache")})
+    settings.apis.stac = api.url
+    cql = TeamsBackgroundGenerator(settings).get_base_cql("sentinel-2-l2a", None)
+
+    def search(use_cache):
+        generator = TeamsBackgroundGenerator(settings, use_cache=use_cache)
+        items, _, _ = generator.search_item_dicts("sentinel-2-l2a", cql, max_items=10)
+        return [item["id"] for item in items]
+
+    assert search(True) == search(True) == ["item"]
+    assert len(api.search_bodies) == 1
+    # --no-cache searches every time, even with a fresh cache entry.
+    assert search(False) == search(False) == ["item"]
+    assert len(api.search_bodies) == 3
+
+
+def test_cached_batched_aoi_search_does_not_open_client(tmp_path, fake_api_factory):
+    api = fake_api_factory(
+        STAC_API_CONFORMANCE + ["https://api.stacspec.org/v1.0.0-rc.1/item-search#sort"]
+    )
+    api.items = [
+        make_item_dict("a-old", "2022-11-02T00:00:00Z", [0, 0, 1, 1]),
+        make_item_dict("b", "2022-11-01T00:00:00Z", [2, 0, 3, 1]),
+        make_item_dict("a-new", "2022-11-03T00:00:00Z", [0, 0, 1, 1]),
+    ]
+    settings = make_settings(
+        tmp_path, max_search_results=2, search_cache={"folder": str(tmp_path / "c")}
+    )
+    settings.apis.stac = api.url
+    features = [
+        {"id": "a", "geometry": mapping(box(0, 0, 1, 1)), "properties": {}},
+        {"id": "b", "geometry": mapping(box(2, 0, 3, 1)), "properties": {}},
+    ]
+
+    def search(generator):
+        items = generator.search_aoi_items_batched(
+            "sentinel-2-l2a",
+            generator.get_base_cql("sentinel-2-l2a", None),
+            "2022-10-01T00:00:00",
+            features,
+            [feature["geometry"] for feature in features],
+            AOIIndex(features),
+            range(2),
+        )
+        return [(item.id, item.properties["aoi"]) for item in items]
+
+    assert search(TeamsBackgroundGenerator(settings)) == [("a-new", "a"), ("b", "b")]
+    assert len(api.search_bodies) == 2
+    generator = TeamsBackgroundGenerator(settings)
+    assert search(generator) == [("a-new", "a"), ("b", "b")]
+    # The cached batch records that it was sorted, so only the AOI without
+    # a match is searched again, also from the cache.
+    assert len(api.search_bodies) == 2
+    assert generator._client is None